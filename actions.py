@@ -1,12 +1,13 @@
 import os
 import csv
-from typing import TypeVar
+from typing import TypeVar, Container
 from abc import ABC, abstractmethod
 from spreadsheet import (
     Income as _Income,
     Sale as _Sale,
     Inventory as _Inventory,
     Shipment as _Shipment,
+    parse_number,
 )
 
 
@@ -20,6 +21,17 @@ PLU = TypeVar('PLU', bound=int)
 Cell = None
 
 
+def read_catalog(items_path: str, name_col: str = 'name', price_col: str = 'price') -> dict[PLU, tuple[str, int | float]]:
+    """
+    Products of items.csv, {plu: (name, price)}
+    """
+    catalog: dict[PLU, tuple[str, int | float]] = {}
+    with open(items_path, 'r', encoding='utf8') as csv_file:
+        for item_data in csv.DictReader(csv_file):
+            catalog[int(item_data['number'])] = (item_data.get(name_col) or '', parse_number(item_data.get(price_col)))
+    return catalog
+
+
 class Builder(ABC):
     """Base action builder"""
     def __init__(self, codes: list[str]) -> None:
@@ -49,6 +61,35 @@ class Builder(ABC):
                 plu = int(item_data['number'])
                 self.items[plu] = item_data
 
+    def _product_codes(self) -> list[str]:
+        return [code for code in self._codes if code.startswith('21')]
+
+    def validate(self, plu_index: Container[PLU] | None = None) -> list[str]:
+        """
+        Reasons why the codes can not be applied, checked against items.csv
+        and plu_index (PLUs which have rows in the spreadsheet) without building
+        """
+        reasons: list[str] = []
+        product_codes = self._product_codes()
+        if not product_codes:
+            reasons.append('No product codes')
+        missing_items: set[PLU] = set()
+        missing_rows: set[PLU] = set()
+        for code in product_codes:
+            plu, weight = code[2:7], code[7:12]
+            if not plu.isdigit() or not weight.isdigit():
+                reasons.append(f'Malformed product code {code}')
+                continue
+            if int(plu) not in self.items:
+                missing_items.add(int(plu))
+            elif plu_index is not None and int(plu) not in plu_index:
+                missing_rows.add(int(plu))
+        if missing_items:
+            reasons.append(f'No such PLU in items.csv: {", ".join(map(str, sorted(missing_items)))}')
+        if missing_rows:
+            reasons.append(f'No such PLU in spreadsheet: {", ".join(map(str, sorted(missing_rows)))}')
+        return reasons
+
     @abstractmethod
     def build(self):
         """
@@ -58,6 +99,17 @@ class Builder(ABC):
 
 
 class ActionBuilder:
+    @classmethod
+    def preflight(cls, codes: list[str], plu_index: Container[PLU] | None = None) -> tuple[Builder | None, list[str]]:
+        """
+        Builder of the codes and reasons why they can not be applied, empty if they can, see Builder.validate
+        """
+        try:
+            builder = cls.get_builder(codes)
+        except ValueError:
+            return None, ['No operation marker']
+        return builder, builder.validate(plu_index)
+
     @classmethod
     def get_builder(cls, codes: list[str]) -> Builder:
         """
@@ -143,6 +195,19 @@ class SaleBuilder(Builder):
     """Sale action builder"""
     __code__ = '0000003000001'
 
+    def validate(self, plu_index: Container[PLU] | None = None) -> list[str]:
+        reasons = super().validate(plu_index)
+        customers = [code for code in self._codes if code.startswith('123456789')]
+        if not customers:
+            reasons.append('No customer code')
+        elif len(customers) > 1:
+            reasons.append('Customer code is already set')
+        elif customers[0] not in self.customers:
+            reasons.append(f'Unknown customer code {customers[0]}')
+        if len([code for code in self._codes if code.startswith('987654321')]) > 1:
+            reasons.append('Destination code is already set')
+        return reasons
+
     def build(self):
         products: dict[PLU, Weight | Amount] = {}
         destination: DestinationCode | None = None
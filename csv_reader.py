@@ -2,22 +2,25 @@ import os
 import sys
 import time
 import shutil
+import signal
 import logging
 import datetime
 from pathlib import Path
-from actions import ActionBuilder
+from actions import ActionBuilder, read_catalog
 from spreadsheet import AccountingSpreadsheet
+from partitions import PartitionedSpreadsheet
+from write_buffer import WriteBuffer, BufferedOperation
+from ledger import Ledger, LedgerSync
+from journal import Journal, content_hash, PENDING, BUFFERED, COMMITTED, FAILED
+from tracing import tracer
+from profiling import Profiler, NullProfiler
+from log_config import setup_logging
 
 import telebot
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-file_handler = logging.FileHandler('./logs/logs.log')
-file_handler.setFormatter(
-    logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-)
-logger.addHandler(file_handler)
+# set by SIGTERM, the loop stops at the next point where no write is in progress
+_stop_requested = False
 
 
 def read_file(file_path: str | Path) -> list[str]:
@@ -28,6 +31,268 @@ def read_file(file_path: str | Path) -> list[str]:
         return [line.rstrip('\n') for line in csv_file.readlines()]
 
 
+def apply_operation(
+        g: AccountingSpreadsheet | PartitionedSpreadsheet,
+        operation: str,
+        params: list,
+        file_date: datetime.date,
+) -> None:
+    """
+    Write operation of a file dated file_date to the spreadsheet
+    """
+    if operation == 'sale':
+        g.create_sale(params, file_date)
+    elif operation == 'income':
+        g.create_income(params, file_date)
+    elif operation == 'shipment':
+        g.create_shipment(params, file_date)
+    elif operation == 'inventory':
+        g.do_inventory(params, file_date - datetime.timedelta(days=1))
+
+
+def quarantine(source: Path, reasons: list[str], quarantine_dir: str | Path = './quarantine_csvs') -> Path:
+    """
+    Moves a rejected file to quarantine_dir, its reasons are written next to it to <file name>.reason.txt
+    """
+    quarantine_dir = Path(quarantine_dir)
+    quarantine_dir.mkdir(parents=True, exist_ok=True)
+    dest = quarantine_dir / source.name
+    (quarantine_dir / f'{source.name}.reason.txt').write_text('\n'.join(reasons) + '\n', encoding='utf8')
+    shutil.move(source, dest)
+    return dest
+
+
+def notify(telegram_bot_token: str | None, chat_id: int | None, text: str) -> None:
+    """
+    Sends text to the telegram chat if the bot is configured
+    """
+    if telegram_bot_token is None or chat_id is None:
+        return
+    try:
+        bot = telebot.TeleBot(telegram_bot_token)
+        bot.send_message(chat_id, text)
+    except Exception as e:
+        logger.error(f'Error was with telegram bot.\n'
+                     f'Error type: {type(e)}\n'
+                     f'Error content: {str(e)}')
+
+
+def handle_file(
+        g: AccountingSpreadsheet | PartitionedSpreadsheet,
+        source: Path,
+        dest: Path,
+        file_date: datetime.date,
+        telegram_bot_token: str | None = None,
+        chat_id: int | None = None,
+        buffer: WriteBuffer | None = None,
+        journal: Journal | None = None,
+        ledger: Ledger | None = None,
+):  # noqa
+    """
+    Read csv file, write its operation to the spreadsheet and move it to dest.
+    With buffer the operation is only checked and buffered, it is written by flush_buffer.
+    With ledger the operation is only checked and recorded there, it is rendered by sync_ledger.
+    With journal a file whose content was already written or buffered is moved without API calls.
+    A file which fails pre-flight validation (no operation marker, unknown PLU or customer)
+    is quarantined before any write
+    """
+    file_name = source.name
+    digest = None
+    if journal is not None:
+        digest = content_hash(source, file_date)
+        known = journal.status(digest)
+        if known is not None and known[0] in (BUFFERED, COMMITTED):
+            logger.warning(
+                f'File {file_name} repeats {known[0]} file {known[1]}, it is skipped',
+                extra={'fields': {'file': file_name, 'op': 'skip', 'status': known[0], 'original': known[1]}}
+            )
+            shutil.move(source, dest)
+            return
+    logger.info(f'Trying to read file along path {source}')
+    with tracer.span('read'):
+        codes = read_file(source)
+    logger.info(f'Read {len(codes)} codes from {file_name}', extra={'fields': {'file': file_name, 'codes': len(codes)}})
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f'Read data: {codes}')
+
+    with tracer.span('validate'):
+        builder, reasons = ActionBuilder.preflight(codes, g.plu_index)
+    if reasons:
+        if digest is not None:
+            journal.record([(digest, file_name, None)], FAILED)
+        dest = quarantine(source, reasons)
+        logger.error(
+            f'File {file_name} was rejected and moved to {dest}: {"; ".join(reasons)}',
+            extra={'fields': {'file': file_name, 'op': 'reject', 'reasons': reasons}}
+        )
+        notify(telegram_bot_token, chat_id, f'Файл **{file_name}** отклонён ❌\n' + '\n'.join(reasons))
+        return
+
+    with tracer.span('build'):
+        operation, params = builder.build()
+    total_weight = round(sum(p.weight for p in params), 3)
+    logger.info(
+        f'Trying to handle operation: {operation.upper()}. PLU count: {len(params)}. Total weight: {total_weight}',
+        extra={'fields': {'file': file_name, 'op': operation, 'plu_count': len(params), 'total_weight': total_weight}}
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f'Params: {params}')
+    entry = [(digest, file_name, operation)]
+    done = False
+
+    def commit(written: list[list]) -> None:
+        nonlocal done
+        if digest is not None:
+            journal.record(entry, COMMITTED)
+        done = True
+
+    try:
+        with tracer.span(operation, products=len(params)):
+            if buffer is None:
+                if ledger is not None:
+                    g.rows_of(params)
+                if digest is not None:
+                    journal.record(entry, PENDING)
+                if ledger is not None:
+                    apply_operation(ledger, operation, params, file_date)
+                    commit([params])
+                else:
+                    # committed as soon as values are written, a file failed after that is not written again
+                    with g.batch(on_written=commit):
+                        apply_operation(g, operation, params, file_date)
+            else:
+                g.rows_of(params)
+                buffer.add(operation, params, file_date, file_name, digest)
+                if digest is not None:
+                    journal.record(entry, BUFFERED)
+        done = True
+        shutil.move(source, dest)
+        logger.info(f'File {source} was moved to {dest}', extra={'fields': {'file': file_name, 'op': operation}})
+    except Exception as e:
+        if digest is not None and not done:
+            journal.record(entry, FAILED)
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        logger.error(f'Error was occurred. Error type: {type(e)}.\n'
+                     f'Error content: {str(e)}\n'
+                     f'Error line: {exc_tb.tb_lineno}\n'
+                     f'Error file: {fname}')
+
+        # save problem csv
+        if not os.path.exists('./error_csvs'):
+            os.mkdir('./error_csvs')
+        error_csv_path = Path('./error_csvs') / file_name
+        if not os.path.exists(error_csv_path):
+            shutil.copyfile(source, error_csv_path)
+
+        # send message about problem csv
+        notify(telegram_bot_token, chat_id, f'При обработке файла **{file_name}** произошла ошибка ❌')
+
+
+def flush_buffer(
+        g: AccountingSpreadsheet | PartitionedSpreadsheet,
+        buffer: WriteBuffer,
+        journal: Journal | None = None,
+) -> None:
+    """
+    Writes buffered operations to the spreadsheet in one batch, they stay buffered if it fails.
+    Written operations are journaled as committed right after the write, before they leave the buffer
+    """
+    count = len(buffer)
+
+    def commit(written: list[BufferedOperation]) -> None:
+        journal.record([(b.content_hash, b.source, b.operation) for b in written if b.content_hash], COMMITTED)
+
+    try:
+        g.validate_layout()
+        with tracer.span('flush', operations=count):
+            applied = buffer.flush(g, apply_operation, commit if journal is not None else None)
+        logger.info(
+            f'Flushed {len(applied)} buffered operations', extra={'fields': {'op': 'flush', 'operations': len(applied)}}
+        )
+    except Exception as e:
+        logger.exception(f'Flush of {count} buffered operations failed: {e}')
+
+
+def sync_ledger(sync: LedgerSync) -> None:
+    """
+    Renders operations recorded since the last sync, they are rendered next time if it fails
+    """
+    try:
+        with tracer.span('sync'):
+            dates = sync.sync()
+        if dates:
+            logger.info(f'Synced {dates} dates from ledger', extra={'fields': {'op': 'sync', 'dates': dates}})
+    except Exception as e:
+        logger.exception(f'Ledger sync failed: {e}')
+
+
+def import_ledger(g: AccountingSpreadsheet | PartitionedSpreadsheet, ledger: Ledger, confirmed: bool) -> None:
+    """
+    Imports values of the spreadsheet into an empty ledger, rendering from the ledger would overwrite them.
+    Raises ValueError if the spreadsheet has values and import is not confirmed
+    """
+    totals = g.read_totals()
+    if not totals:
+        return
+    if not confirmed:
+        raise ValueError(
+            'The spreadsheet has values which the empty ledger has not, rendering would overwrite them. '
+            'Import them with --ledger-import first'
+        )
+    with tracer.span('import ledger', dates=len(totals)):
+        rows = ledger.import_totals(totals)
+    logger.info(f'Imported {rows} values of {len(totals)} dates into the ledger', extra={'fields': {
+        'op': 'import', 'dates': len(totals), 'rows': rows,
+    }})
+
+
+def _terminate(signum, frame) -> None:
+    global _stop_requested
+    _stop_requested = True
+
+
+def _sleep(seconds: float) -> None:
+    """
+    Sleeps for seconds, returns early if stop is requested
+    """
+    deadline = time.monotonic() + seconds
+    while not _stop_requested and time.monotonic() < deadline:
+        time.sleep(min(1.0, deadline - time.monotonic()))
+
+
+def provision_products(g: AccountingSpreadsheet | PartitionedSpreadsheet, items_path: str) -> None:
+    """
+    Adds rows of items.csv products which the spreadsheet has not
+    """
+    try:
+        added = g.provision_products(read_catalog(items_path))
+        if added:
+            logger.info(f'Added {len(added)} product rows', extra={'fields': {
+                'op': 'provision', 'plu': [p.plu for p in added],
+            }})
+    except Exception as e:
+        logger.exception(f'Product provisioning failed: {e}')
+
+
+def preallocate(g: AccountingSpreadsheet | PartitionedSpreadsheet, days: int) -> None:
+    """
+    Creates blocks of dates from today to today + days while there are no files to handle
+    """
+    today = datetime.date.today()
+    try:
+        g.validate_layout()
+        with tracer.span('preallocate', days=days):
+            created = g.preallocate_dates(today, today + datetime.timedelta(days=days))
+        if created:
+            g.remember_layout()
+            logger.info(f'Preallocated {len(created)} dates', extra={'fields': {
+                'op': 'preallocate', 'from': created[0].date.isoformat(), 'to': created[-1].date.isoformat(),
+            }})
+    except Exception as e:
+        logger.exception(f'Preallocation failed: {e}')
+
+
 def main(
         customers_path: str,
         items_path: str,
@@ -38,10 +303,49 @@ def main(
         gid: int,
         telegram_bot_token: str | None = None,
         chat_id: int | None = None,
+        trace_path: str | None = None,
+        profile_dir: str | None = None,
+        log_path: str = './logs/logs.log',
+        json_logs: bool = False,
+        log_level: int = logging.INFO,
+        preallocate_days: int | None = None,
+        layout: str = 'insert',
+        summary_gid: int | None = None,
+        summary_mode: str = 'terms',
+        checkpoint_on: tuple[str, ...] = (),
+        partition_period: str | None = None,
+        partition_max_cols: int | None = None,
+        buffer_path: str | None = None,
+        buffer_max_ops: int = 100,
+        buffer_max_age: float = 300.0,
+        journal_path: str | None = None,
+        ledger_path: str | None = None,
+        ledger_import: bool = False,
+        sales_log_gid: int | None = None,
+        sync_catalog: bool = False,
 ):  # noqa
     """
     Start func
+    If trace_path is given, spans of every handled file are written there (see tracing.py)
+    If profile_dir is given, cProfile and tracemalloc reports of every cycle are written there
+    If json_logs is True, log records are written as JSON lines with summary fields
+    If preallocate_days is given, idle cycles create blocks of the next preallocate_days days in one request
+    If layout is 'append', date blocks are added at the right edge and month summaries go to summary_gid sheet
+    summary_mode and checkpoint_on are passed to the spreadsheet, see AccountingSpreadsheet
+    If partition_period or partition_max_cols is given, dates of every period (or every max cols)
+    go to their own sheet tab, see partitions.py
+    If buffer_path is given, files are acknowledged once their operations are saved there
+    and the operations are written when buffer_max_ops are collected, the oldest one is buffer_max_age
+    seconds old or on SIGTERM, see write_buffer.py
+    If journal_path is given, written files are recorded there by content hash
+    and files seen again are skipped without API calls, see journal.py
+    If ledger_path is given, operations are recorded to SQLite ledger there and the spreadsheet
+    is rendered from it after every cycle, see ledger.py. It can not be combined with buffer_path.
+    An empty ledger is not started over a spreadsheet with values unless ledger_import is True,
+    then the values are imported into the ledger first
     """
+    if buffer_path is not None and ledger_path is not None:
+        raise ValueError('ledger already defers writes, it can not be combined with write buffer')
     if not os.path.exists(customers_path):
         raise FileExistsError(f'No such file {customers_path}')
     if not os.path.exists(items_path):
@@ -53,72 +357,118 @@ def main(
     if not os.path.exists(creds_path):
         raise FileExistsError(f'No such file {creds_path}')
 
+    setup_logging(logger, log_path, structured=json_logs, level=log_level)
     os.environ['CUSTOMER_PATH'] = customers_path
     os.environ['ITEMS_PATH'] = items_path
+    if trace_path is not None:
+        tracer.open(trace_path)
+    profiler = Profiler(profile_dir) if profile_dir is not None else NullProfiler()
     print('Started!')
-    while True:
+    # session lives across cycles, layout is loaded lazily by the first cycle with files
+    if partition_period is not None or partition_max_cols is not None:
+        g = PartitionedSpreadsheet(
+            spreadsheet_id, gid, creds_path, logger, period=partition_period or 'year', max_cols=partition_max_cols,
+            summary_mode=summary_mode, checkpoint_on=tuple(checkpoint_on), sales_log_gid=sales_log_gid
+        )
+    else:
+        g = AccountingSpreadsheet(
+            spreadsheet_id, gid, creds_path, logger, layout=layout, summary_gid=summary_gid,
+            summary_mode=summary_mode, checkpoint_on=tuple(checkpoint_on), sales_log_gid=sales_log_gid
+        )
+    journal = None
+    if journal_path is not None:
+        journal = Journal(journal_path)
+        for _, file_name in journal.interrupted():
+            logger.warning(f'Writing of file {file_name} was interrupted, check its values in the spreadsheet')
+    buffer = None
+    if buffer_path is not None:
+        buffer = WriteBuffer(buffer_path, buffer_max_ops, buffer_max_age, logger)
+        if journal is not None:
+            # flushed right before the previous run stopped, but not removed from the buffer
+            for b in buffer.drop(lambda b: (journal.status(b.content_hash) or (None,))[0] == COMMITTED):
+                logger.info(f'Buffered operation of {b.source} is already written, it is dropped')
+        signal.signal(signal.SIGTERM, _terminate)
+    sync = None
+    if ledger_path is not None:
+        sync = LedgerSync(Ledger(ledger_path), g)
+        if not len(sync.ledger):
+            import_ledger(g, sync.ledger, ledger_import)
+        elif ledger_import:
+            logger.warning(f'Ledger {ledger_path} already has operations, nothing is imported')
+        g.index.load(sync.ledger.totals())
+        signal.signal(signal.SIGTERM, _terminate)
+    try:
+        _loop(
+            g, from_csvs, to_csvs, telegram_bot_token, chat_id, profiler, preallocate_days, buffer, journal, sync,
+            items_path if sync_catalog else None
+        )
+    finally:
+        if buffer is not None and len(buffer):
+            flush_buffer(g, buffer, journal)
+        if sync is not None:
+            sync_ledger(sync)
+
+
+def _loop(
+        g: AccountingSpreadsheet | PartitionedSpreadsheet,
+        from_csvs: str,
+        to_csvs: str,
+        telegram_bot_token: str | None,
+        chat_id: int | None,
+        profiler: Profiler | NullProfiler,
+        preallocate_days: int | None,
+        buffer: WriteBuffer | None,
+        journal: Journal | None,
+        sync: LedgerSync | None,
+        items_path: str | None = None,
+) -> None:
+    ledger = sync.ledger if sync is not None else None
+    while not _stop_requested:
         files = os.listdir(from_csvs)
         files_with_date = [
             {'date': datetime.datetime.strptime(f.split('_').pop(1), '%Y-%m-%d').date(), 'file_name': f}
             for f in files
         ]
         files_with_date.sort(key=lambda file_with_date: file_with_date['date'])
-        g = AccountingSpreadsheet(spreadsheet_id, gid, creds_path, logger)
+        if files_with_date:
+            profiler.next_cycle()
+            with profiler.trace_allocations('warmup'):
+                g.validate_layout()
+                g.warm_up()
+            if items_path is not None:
+                provision_products(g, items_path)
         for f in files_with_date:
+            if _stop_requested:
+                break
             file_name = f['file_name']
 
             source = Path(from_csvs) / file_name
             dest = Path(to_csvs) / file_name
 
-            logger.info(f'Trying to read file along path {source}')
-            codes = read_file(source)
-            logger.info(f'Read data: {codes}')
-
-            builder = ActionBuilder.get_builder(codes)
-            operation, params = builder.build()
-            logger.info(f'Trying to handle operation: {operation.upper()}. Params: {params}')
-            try:
-                if operation == 'sale':
-                    g.create_sale(params, f['date'])
-                elif operation == 'income':
-                    g.create_income(params, f['date'])
-                elif operation == 'shipment':
-                    g.create_shipment(params, f['date'])
-                elif operation == 'inventory':
-                    g.do_inventory(params, f['date'] - datetime.timedelta(days=1))
-                shutil.move(source, dest)
-                logger.info(f'File {source} was moved to {dest}')
-            except Exception as e:
-                exc_type, exc_obj, exc_tb = sys.exc_info()
-                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                logger.error(f'Error was occurred. Error type: {type(e)}.\n'
-                             f'Error content: {str(e)}\n'
-                             f'Error line: {exc_tb.tb_lineno}\n'
-                             f'Error file: {fname}')
-
-                # save problem csv
-                if not os.path.exists('./error_csvs'):
-                    os.mkdir('./error_csvs')
-                error_csv_path = Path('./error_csvs') / file_name
-                if not os.path.exists(error_csv_path):
-                    shutil.copyfile(source, error_csv_path)
-
-                # send message about problem csv
-                if telegram_bot_token is not None and chat_id is not None:
-                    try:
-                        bot = telebot.TeleBot(telegram_bot_token)
-                        bot.send_message(
-                            chat_id,
-                            f'При обработке файла **{file_name}** произошла ошибка ❌'
-                        )
-                    except Exception as e:
-                        logger.error(f'Error was with telegram bot.\n'
-                                     f'Error type: {type(e)}\n'
-                                     f'Error content: {str(e)}')
-        del g
+            with tracer.span('file', file=file_name), profiler.profile_file(file_name):
+                handle_file(g, source, dest, f['date'], telegram_bot_token, chat_id, buffer, journal, ledger)
+            if buffer is not None and buffer.due():
+                flush_buffer(g, buffer, journal)
+        profiler.finish_cycle()
+        if buffer is not None and buffer.due():
+            flush_buffer(g, buffer, journal)
+        if sync is not None:
+            sync_ledger(sync)
+        if files_with_date:
+            g.remember_layout()
+        if _stop_requested:
+            logger.info('Stopped by SIGTERM')
+            return
         if len(files_with_date) > 0:
             logger.info('All files were handled')
         else:
             logger.info(f'No files were found in "{from_csvs}" folder')
-        logger.info('Sleep for 1 hours')
-        time.sleep(3600)
+            if preallocate_days:
+                preallocate(g, preallocate_days)
+        seconds_left = buffer.seconds_left() if buffer is not None else None
+        if seconds_left is not None and seconds_left < 3600:
+            logger.info(f'Sleep for {seconds_left:.0f} seconds until buffer flush')
+            _sleep(seconds_left)
+        else:
+            logger.info('Sleep for 1 hours')
+            _sleep(3600)
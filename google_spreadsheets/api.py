@@ -6,8 +6,9 @@ import apiclient.discovery
 from oauth2client.service_account import ServiceAccountCredentials
 from .interface import *
 from .Dataclasses import Cell
-from .utils import from_cells_to_google_format, from_google_format_to_cell, sort_cells, \
-    to_rows_format, parse_sheets, find_sheet
+from .utils import from_cells_to_google_format, from_google_format_to_cell, from_value_ranges_to_cell, \
+    sort_cells, to_rows_format, parse_sheets, find_sheet, update_cells_requests, insert_dimension_request, \
+    append_cells_request
 
 
 ColumnCount = TypeVar('CoulmnCount', bound=int)
@@ -119,6 +120,19 @@ class GoogleSheets(GoogleSheetsInterface):
         ).execute()
         return response
 
+    def insert_dimension(self, dimension: Literal['ROWS', 'COLUMNS'], sheet_id: int, start_idx: int, end_idx: int,
+                         inherit_from_before: bool = False) -> dict:
+        """
+        Insert whole rows or columns [start_idx, end_idx).
+        Unlike insert_range it moves developer metadata attached to shifted columns
+        """
+        body = insert_dimension_request(sheet_id, dimension, start_idx, end_idx, inherit_from_before)
+        response = self.sheets_v4.spreadsheets().batchUpdate(
+            spreadsheetId=self.spreadsheetId,
+            body={'requests': [body]}
+        ).execute()
+        return response
+
     def merge_cells(self, from_cell: Cell, to_cell: Cell, sheet_id: int) -> dict:
 
         sri = from_cell.row_idx
@@ -146,17 +160,7 @@ class GoogleSheets(GoogleSheetsInterface):
 
     def append(self, cells: Iterable[Iterable[Cell]], sheet_id: int = 0) -> dict:
         """REDO must have view [[], []]"""
-        rows = []
-        for row in cells:
-            rows.append({'values': from_cells_to_google_format(row)})
-        body = {
-            'appendCells': {
-                'sheetId': sheet_id,
-                'rows': rows,
-                'fields': '*'
-            }
-        }
-
+        body = append_cells_request(cells, sheet_id)
         response = self.sheets_v4.spreadsheets().batchUpdate(
             spreadsheetId=self.spreadsheetId,
             body={'requests': [body]}
@@ -187,6 +191,112 @@ class GoogleSheets(GoogleSheetsInterface):
         ).execute()
         return from_google_format_to_cell(response, from_)
 
+    def get_values_batch(self, ranges: list[tuple[str | Cell, str | Cell]], sheet_name: str = None,
+                         sheet_id: int = None, include_grid_data: bool = True) -> Iterator[Cell]:
+        """
+        Return cells of several ranges of one sheet fetched in one request.
+        Without grid data only unformatted values are fetched, with no notes and formats
+        """
+        if sheet_name is None:
+            sheet_name = find_sheet(self.sheets, id=sheet_id).title
+        a1_ranges = []
+        for from_, to in ranges:
+            from_ = from_.name if isinstance(from_, Cell) else from_
+            to = to.name if isinstance(to, Cell) else to
+            a1_ranges.append("'{0}'!{1}:{2}".format(sheet_name, from_, to))
+        if not include_grid_data:
+            response = self.sheets_v4.spreadsheets().values().batchGet(
+                spreadsheetId=self.spreadsheetId,
+                ranges=a1_ranges,
+                valueRenderOption='UNFORMATTED_VALUE',
+            ).execute()
+            return from_value_ranges_to_cell(response.get('valueRanges', []))
+        response = self.sheets_v4.spreadsheets().get(
+            spreadsheetId=self.spreadsheetId,
+            ranges=a1_ranges,
+            includeGridData=True
+        ).execute()
+        return from_google_format_to_cell(response)
+
+    def get_formatted_values(self, ranges: list[str]) -> list[list[list[str]]]:
+        """
+        Return formatted values of given A1 ranges in one request without grid data
+        """
+        response = self.sheets_v4.spreadsheets().values().batchGet(
+            spreadsheetId=self.spreadsheetId,
+            ranges=ranges,
+            valueRenderOption='FORMATTED_VALUE',
+        ).execute()
+        return [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+
+    def batch_update(self, requests: list[dict]) -> dict:
+        """
+        Send given requests in one batchUpdate, they are applied atomically
+        """
+        response = self.sheets_v4.spreadsheets().batchUpdate(
+            spreadsheetId=self.spreadsheetId,
+            body={'requests': requests}
+        ).execute()
+        if any('addSheet' in r or 'deleteSheet' in r for r in requests):
+            self._sheets = None
+        return response
+
+    def create_developer_metadata(self, metadata: list[dict]) -> list[dict]:
+        """
+        Create developer metadata in one request, return created items in the same order
+        """
+        requests = [{'createDeveloperMetadata': {'developerMetadata': m}} for m in metadata]
+        response = self.batch_update(requests)
+        return [reply['createDeveloperMetadata']['developerMetadata'] for reply in response.get('replies', [])]
+
+    def update_developer_metadata(self, metadata: list[dict]) -> dict:
+        """
+        Replace location and value of existing developer metadata found by metadataId
+        """
+        requests = []
+        for m in metadata:
+            requests.append({
+                'updateDeveloperMetadata': {
+                    'dataFilters': [{'developerMetadataLookup': {'metadataId': m['metadataId']}}],
+                    'developerMetadata': {k: v for k, v in m.items() if k != 'metadataId'},
+                    'fields': 'location,metadataValue',
+                }
+            })
+        return self.batch_update(requests)
+
+    def search_developer_metadata(self, data_filters: list[dict]) -> list[dict]:
+        """
+        Return developer metadata matched by any of given data filters
+        """
+        response = self.sheets_v4.spreadsheets().developerMetadata().search(
+            spreadsheetId=self.spreadsheetId,
+            body={'dataFilters': data_filters}
+        ).execute()
+        return [m['developerMetadata'] for m in response.get('matchedDeveloperMetadata', [])]
+
+    def get_named_ranges(self) -> list[dict]:
+        """
+        Return all named ranges of the spreadsheet
+        """
+        response = self.sheets_v4.spreadsheets().get(
+            spreadsheetId=self.spreadsheetId,
+            fields='namedRanges'
+        ).execute()
+        return response.get('namedRanges', [])
+
+    def update_named_range(self, named_range_id: str, name: str, grid_range: dict) -> dict:
+        body = {
+            'updateNamedRange': {
+                'namedRange': {
+                    'namedRangeId': named_range_id,
+                    'name': name,
+                    'range': grid_range,
+                },
+                'fields': 'range',
+            }
+        }
+        return self.batch_update([body])
+
     def create_spreadsheet(self, title: str) -> dict:
         spreadsheet = {
             'properties': {
@@ -205,24 +315,7 @@ class GoogleSheets(GoogleSheetsInterface):
     def update_cells(self, cells: Iterable[Cell], sheet_id: int = 0) -> list:
         if not cells:
             raise Exception('"cells" must not be empty')
-        responses = []
-        cells = sort_cells(cells)
-        rows = to_rows_format(cells)
-        requests = []
-        for row, columnIndex, rowIndex in rows:
-            body = {
-                'updateCells': {
-                    'rows': [row],
-                    'fields': '*',
-                    'start': {
-                        'sheetId': sheet_id,
-                        'rowIndex': rowIndex,
-                        'columnIndex': columnIndex,
-                    },
-                }
-            }
-            cells = cells[len(row):]
-            requests.append(body)
+        requests = update_cells_requests(cells, sheet_id)
         response = self.sheets_v4.spreadsheets().batchUpdate(
             spreadsheetId=self.spreadsheetId,
             body={'requests': requests},
@@ -95,13 +95,17 @@ def borders_from_google_format(dictionary: dict) -> Borders:
 #     return result if isinstance(result, int) else ord(result)
 
 
-def from_google_format_to_cell(response: dict, from_: str) -> Iterator[Cell]:
+def from_google_format_to_cell(response: dict, from_: str | None = None) -> Iterator[Cell]:
     """Inspect given data and return list of Cells
+    If from_ is None, every range is placed by its own startRow and startColumn
     TODO Not the whole data yet"""
-    col, row = Cell.find_indexes(from_)
+    if from_ is not None:
+        col, row = Cell.find_indexes(from_)
 
     data = inspector(response, ['data'])
     for idx in range(len(data['data'])):
+        if from_ is None:
+            col, row = data['data'][idx].get('startColumn', 0), data['data'][idx].get('startRow', 0)
         i = 0
         try:
             rowData = data['data'][idx]['rowData']
@@ -276,6 +280,119 @@ def to_rows_format(cells: list[Cell]) -> \
     return result
 
 
+def update_cells_requests(cells: Iterable[Cell], sheet_id: int = 0, fields: str = '*') -> list[dict]:
+    """
+    Build updateCells requests for given cells, neighbour cells of a row share one request.
+    Only given fields are written, '*' also clears notes of cells without a note
+    """
+    cells = sort_cells(cells)
+    requests = []
+    for row, columnIndex, rowIndex in to_rows_format(cells):
+        requests.append({
+            'updateCells': {
+                'rows': [row],
+                'fields': fields,
+                'start': {
+                    'sheetId': sheet_id,
+                    'rowIndex': rowIndex,
+                    'columnIndex': columnIndex,
+                },
+            }
+        })
+    return requests
+
+
+def from_value_ranges_to_cell(value_ranges: list[dict]) -> Iterator[Cell]:
+    """
+    Cells of values().batchGet value ranges, every range is placed by the start of its A1 range
+    """
+    for value_range in value_ranges:
+        start = value_range['range'].rsplit('!', 1)[-1].split(':')[0]
+        col, row = Cell.find_indexes(start)
+        for i, values in enumerate(value_range.get('values', [])):
+            for j, value in enumerate(values):
+                if value != '':
+                    yield Cell(value=value, col_idx=col + j, row_idx=row + i)
+
+
+def append_cells_request(rows: Iterable[Iterable[Cell]], sheet_id: int = 0) -> dict:
+    """
+    Build appendCells request adding rows of cells after the last row with data
+    """
+    return {
+        'appendCells': {
+            'sheetId': sheet_id,
+            'rows': [{'values': from_cells_to_google_format(row)} for row in rows],
+            'fields': '*',
+        }
+    }
+
+
+def grid_range(sheet_id: int, start_row: int | None = None, end_row: int | None = None,
+               start_col: int | None = None, end_col: int | None = None) -> dict:
+    """
+    GridRange body, omitted bounds mean unbounded
+    """
+    bounds = {
+        'startRowIndex': start_row,
+        'endRowIndex': end_row,
+        'startColumnIndex': start_col,
+        'endColumnIndex': end_col,
+    }
+    return {'sheetId': sheet_id} | {k: v for k, v in bounds.items() if v is not None}
+
+
+def pivot_table_request(source: dict, sheet_id: int, rows: Iterable[int], values: Iterable[tuple[int, str]]) -> dict:
+    """
+    Build updateCells request placing at A1 of the sheet a pivot table of source grid range,
+    grouped by rows column offsets with SUM of (column offset, name) values
+    """
+    pivot_table = {
+        'source': source,
+        'rows': [{'sourceColumnOffset': offset, 'showTotals': True, 'sortOrder': 'ASCENDING'} for offset in rows],
+        'values': [{'sourceColumnOffset': offset, 'summarizeFunction': 'SUM', 'name': name} for offset, name in values],
+    }
+    return {
+        'updateCells': {
+            'rows': [{'values': [{'pivotTable': pivot_table}]}],
+            'fields': 'pivotTable',
+            'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+        }
+    }
+
+
+def add_named_range_request(name: str, grid_range: dict) -> dict:
+    return {'addNamedRange': {'namedRange': {'name': name, 'range': grid_range}}}
+
+
+def insert_dimension_request(sheet_id: int, dimension: str, start_idx: int, end_idx: int,
+                             inherit_from_before: bool = False) -> dict:
+    return {
+        'insertDimension': {
+            'range': {
+                'sheetId': sheet_id,
+                'dimension': dimension,
+                'startIndex': start_idx,
+                'endIndex': end_idx,
+            },
+            'inheritFromBefore': inherit_from_before,
+        }
+    }
+
+
+def merge_cells_request(grid_range: dict) -> dict:
+    return {'mergeCells': {'range': grid_range, 'mergeType': 'MERGE_ALL'}}
+
+
+def add_sheet_request(title: str, sheet_id: int | None = None, row_count: int | None = None) -> dict:
+    properties: dict = {'title': title}
+    if sheet_id is not None:
+        properties['sheetId'] = sheet_id
+    if row_count is not None:
+        properties['gridProperties'] = {'rowCount': row_count}
+    return {'addSheet': {'properties': properties}}
+
+
 # TODO добавить dataclass Sheet
 def parse_sheets(response: dict) -> list[Sheet]:
     sheets = []
@@ -295,3 +412,22 @@ def find_sheet(sheets: list[Sheet], id: int = None, title: str = None) -> Sheet:
             return sheet
     else:
         raise Exception('Sheet not found')
+
+
+def columns_metadata(sheet_id: int, start_idx: int, end_idx: int, key: str, value: str) -> dict:
+    """
+    DeveloperMetadata body attached to columns [start_idx, end_idx) of the sheet
+    """
+    return {
+        'metadataKey': key,
+        'metadataValue': value,
+        'location': {
+            'dimensionRange': {
+                'sheetId': sheet_id,
+                'dimension': 'COLUMNS',
+                'startIndex': start_idx,
+                'endIndex': end_idx,
+            }
+        },
+        'visibility': 'DOCUMENT',
+    }
@@ -0,0 +1,82 @@
+import time
+import sqlite3
+import hashlib
+import datetime
+from pathlib import Path
+from typing import Iterable
+
+
+# statuses of a file operation, the last recorded one is current
+PENDING = 'pending'
+BUFFERED = 'buffered'
+COMMITTED = 'committed'
+FAILED = 'failed'
+
+
+def content_hash(path: str | Path, file_date: datetime.date) -> str:
+    """
+    Hash of file content and its date, identical uploads of one scanner file get the same hash
+    """
+    digest = hashlib.sha256(file_date.isoformat().encode())
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Journal:
+    """
+    Append-only journal of file operations in SQLite (WAL mode, synchronous commits).
+    Every status change of a file is a new row, the last row of a content hash is its status.
+    A file is committed right after its values are written, so it is skipped without API calls
+    when it is seen again: after a crash before it was moved or as a duplicate upload
+    """
+    def __init__(self, path: str | Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=FULL')
+        with self._connection:
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS journal (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    content_hash TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    operation TEXT,
+                    status TEXT NOT NULL,
+                    recorded_at REAL NOT NULL
+                )
+            ''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS journal_hash ON journal (content_hash, id)')
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def status(self, content_hash: str) -> tuple[str, str] | None:
+        """
+        (status, file name) last recorded for the hash, None if the hash is new
+        """
+        return self._connection.execute(
+            'SELECT status, file_name FROM journal WHERE content_hash = ? ORDER BY id DESC LIMIT 1', (content_hash,)
+        ).fetchone()
+
+    def record(self, entries: Iterable[tuple[str, str, str | None]], status: str) -> None:
+        """
+        Records status of (content hash, file name, operation) entries in one transaction
+        """
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                'INSERT INTO journal (content_hash, file_name, operation, status, recorded_at) VALUES (?, ?, ?, ?, ?)',
+                [(h, file_name, operation, status, now) for h, file_name, operation in entries]
+            )
+
+    def interrupted(self) -> list[tuple[str, str]]:
+        """
+        (content hash, file name) of operations whose last status is pending:
+        the process stopped while writing them, so they may be written or not
+        """
+        return self._connection.execute('''
+            SELECT content_hash, file_name FROM journal AS j
+            WHERE status = ? AND id = (SELECT MAX(id) FROM journal WHERE content_hash = j.content_hash)
+        ''', (PENDING,)).fetchall()
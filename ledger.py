@@ -0,0 +1,230 @@
+import sqlite3
+import datetime
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Iterator, Any
+from spreadsheet import Shipment, Income, Sale, Inventory
+from stock_index import WRITE_OFF_CUSTOMERS, round_weight
+
+
+# {date: {plu: {(kind, customer): total weight}}}, customer is set for sales only
+Totals = dict[datetime.date, dict[int, dict[tuple[str, str | None], int | float]]]
+
+
+class Ledger:
+    """
+    Local ledger of applied operations in SQLite, one row per product of an operation.
+    It has the same write methods as AccountingSpreadsheet, so operations can be recorded
+    instead of written, and the spreadsheet is rendered from it by LedgerSync
+    """
+    def __init__(self, path: str | Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=FULL')
+        self._in_batch = False
+        with self._connection:
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS operations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    date TEXT NOT NULL,
+                    plu INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    customer TEXT,
+                    weight REAL NOT NULL,
+                    synced INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS operations_date_plu ON operations (date, plu)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS operations_plu_date ON operations (plu, date)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS operations_unsynced ON operations (id) WHERE synced = 0')
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __len__(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM operations').fetchone()[0]
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Records operations of the block in one transaction
+        """
+        if self._in_batch:
+            yield
+            return
+        self._in_batch = True
+        try:
+            with self._connection:
+                yield
+        finally:
+            self._in_batch = False
+
+    def _add(self, kind: str, items: list, date: datetime.date | None) -> None:
+        if date is None:
+            date = datetime.datetime.now().date()
+        rows = [(date.isoformat(), item.plu, kind, getattr(item, 'customer', None), item.weight) for item in items]
+        with self.batch():
+            self._connection.executemany(
+                'INSERT INTO operations (date, plu, kind, customer, weight) VALUES (?, ?, ?, ?, ?)', rows
+            )
+
+    def create_shipment(self, shipments: list[Shipment], date: datetime.date | None = None):
+        self._add('shipment', shipments, date)
+
+    def create_income(self, incomes: list[Income], date: datetime.date | None = None):
+        self._add('income', incomes, date)
+
+    def create_sale(self, sales: list[Sale], date: datetime.date | None = None):
+        self._add('sale', sales, date)
+
+    def do_inventory(self, inventories: list[Inventory], date: datetime.date | None = None):
+        self._add('inventory', inventories, date)
+
+    def import_totals(self, totals: Totals) -> int:
+        """
+        Records totals read from the spreadsheet (see AccountingSpreadsheet.read_totals) as synced operations,
+        so values written before the ledger was enabled are kept when their cells are rendered.
+        Returns number of recorded rows
+        """
+        rows = [
+            (date.isoformat(), plu, kind, customer, weight)
+            for date, by_plu in totals.items()
+            for plu, by_kind in by_plu.items()
+            for (kind, customer), weight in by_kind.items()
+        ]
+        with self.batch():
+            self._connection.executemany(
+                'INSERT INTO operations (date, plu, kind, customer, weight, synced) VALUES (?, ?, ?, ?, ?, 1)', rows
+            )
+        return len(rows)
+
+    def _totals(self, where: str, params: tuple) -> Totals:
+        totals: Totals = {}
+        for date, plu, kind, customer, weight in self._connection.execute(f'''
+            SELECT date, plu, kind, customer, SUM(weight) FROM operations
+            WHERE {where} GROUP BY date, plu, kind, customer
+        ''', params):
+            weight = round_weight(weight)
+            totals.setdefault(datetime.date.fromisoformat(date), {}).setdefault(plu, {})[(kind, customer)] = weight
+        return totals
+
+    def totals(self, start: datetime.date | None = None, end: datetime.date | None = None) -> Totals:
+        """
+        Totals of all products of dates from start to end (inclusive)
+        """
+        return self._totals('date BETWEEN ? AND ?', self._range(start, end))
+
+    def unsynced(self) -> tuple[int | None, Totals]:
+        """
+        Last id of unsynced operations and full totals of (date, PLU) pairs they touch
+        """
+        last_id = self._connection.execute('SELECT MAX(id) FROM operations WHERE synced = 0').fetchone()[0]
+        if last_id is None:
+            return None, {}
+        return last_id, self._totals(
+            'id <= ? AND (date, plu) IN (SELECT date, plu FROM operations WHERE synced = 0 AND id <= ?)',
+            (last_id, last_id)
+        )
+
+    def _range(self, start: datetime.date | None, end: datetime.date | None) -> tuple[str, str]:
+        return (
+            start.isoformat() if start is not None else '0000-00-00',
+            end.isoformat() if end is not None else '9999-99-99',
+        )
+
+    def daily_sales(self, start: datetime.date | None = None, end: datetime.date | None = None) -> list[dict]:
+        """
+        Sold weight by date and customer, write-offs excluded
+        """
+        placeholders = ', '.join('?' * len(WRITE_OFF_CUSTOMERS))
+        return [
+            {'date': date, 'customer': customer, 'weight': round_weight(weight)}
+            for date, customer, weight in self._connection.execute(f'''
+                SELECT date, customer, SUM(weight) FROM operations
+                WHERE kind = 'sale' AND date BETWEEN ? AND ? AND (customer IS NULL OR customer NOT IN ({placeholders}))
+                GROUP BY date, customer ORDER BY date, customer
+            ''', (*self._range(start, end), *WRITE_OFF_CUSTOMERS))
+        ]
+
+    def monthly_write_offs(self, start: datetime.date | None = None, end: datetime.date | None = None) -> list[dict]:
+        """
+        Written off weight by month and write-off column
+        """
+        placeholders = ', '.join('?' * len(WRITE_OFF_CUSTOMERS))
+        return [
+            {'month': month, 'customer': customer, 'weight': round_weight(weight)}
+            for month, customer, weight in self._connection.execute(f'''
+                SELECT substr(date, 1, 7) AS month, customer, SUM(weight) FROM operations
+                WHERE kind = 'sale' AND date BETWEEN ? AND ? AND customer IN ({placeholders})
+                GROUP BY month, customer ORDER BY month, customer
+            ''', (*self._range(start, end), *WRITE_OFF_CUSTOMERS))
+        ]
+
+    def top_products(self, start: datetime.date | None = None, end: datetime.date | None = None,
+                     limit: int = 10) -> list[dict]:
+        """
+        PLUs with the largest sold weight, write-offs excluded
+        """
+        placeholders = ', '.join('?' * len(WRITE_OFF_CUSTOMERS))
+        return [
+            {'plu': plu, 'weight': round_weight(weight)}
+            for plu, weight in self._connection.execute(f'''
+                SELECT plu, SUM(weight) AS total FROM operations
+                WHERE kind = 'sale' AND date BETWEEN ? AND ? AND (customer IS NULL OR customer NOT IN ({placeholders}))
+                GROUP BY plu ORDER BY total DESC, plu LIMIT ?
+            ''', (*self._range(start, end), *WRITE_OFF_CUSTOMERS, limit))
+        ]
+
+    def mark_synced(self, last_id: int | None = None) -> None:
+        """
+        Marks operations up to last_id (all if None) as rendered into the spreadsheet
+        """
+        with self._connection:
+            if last_id is None:
+                self._connection.execute('UPDATE operations SET synced = 1 WHERE synced = 0')
+            else:
+                self._connection.execute('UPDATE operations SET synced = 1 WHERE synced = 0 AND id <= ?', (last_id,))
+
+
+class LedgerSync:
+    """
+    Renders the ledger into the spreadsheet, which becomes its projection.
+    Totals of touched cells are written as values, not increments, so rendering can be repeated safely
+    """
+    def __init__(self, ledger: Ledger, g: Any, dates_per_batch: int = 31) -> None:
+        """
+        g - AccountingSpreadsheet or PartitionedSpreadsheet
+        dates_per_batch - dates rendered by one write request
+        """
+        self.ledger = ledger
+        self._g = g
+        self._dates_per_batch = dates_per_batch
+
+    def _render(self, totals: Totals) -> None:
+        dates = sorted(totals)
+        for i in range(0, len(dates), self._dates_per_batch):
+            self._g.render({date: totals[date] for date in dates[i:i + self._dates_per_batch]})
+
+    def sync(self) -> int:
+        """
+        Renders (date, PLU) cells touched by operations recorded since the last sync.
+        Returns number of rendered dates
+        """
+        last_id, totals = self.ledger.unsynced()
+        if last_id is None:
+            return 0
+        self._render(totals)
+        self.ledger.mark_synced(last_id)
+        return len(totals)
+
+    def rebuild(self, start: datetime.date | None = None, end: datetime.date | None = None) -> int:
+        """
+        Renders all ledger cells of dates from start to end (inclusive).
+        Returns number of rendered dates
+        """
+        totals = self.ledger.totals(start, end)
+        self._render(totals)
+        if start is None and end is None:
+            self.ledger.mark_synced()
+        return len(totals)
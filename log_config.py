@@ -0,0 +1,62 @@
+import json
+import queue
+import atexit
+import logging
+import datetime
+from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats record as one JSON object per line.
+    Summary fields are taken from extra={'fields': {...}}
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(
+        logger: logging.Logger,
+        path: str | Path = './logs/logs.log',
+        structured: bool = False,
+        level: int = logging.INFO,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+) -> QueueListener:
+    """
+    Attach QueueHandler to logger and start QueueListener
+    which writes records to size-rotated file in a background thread
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf8')
+    file_handler.setFormatter(JsonFormatter() if structured else logging.Formatter(TEXT_FORMAT))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    logger.setLevel(level)
+    logger.addHandler(QueueHandler(records))
+    listener = QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener: QueueListener) -> None:
+    try:
+        listener.stop()
+    except AttributeError:  # already stopped
+        pass
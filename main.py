@@ -1,6 +1,171 @@
+import logging
+import argparse
+import datetime
 from csv_reader import main
+from reports import REPORTS, make_report
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--profile',
+        metavar='DIR',
+        default=None,
+        help='write cProfile and tracemalloc reports of every cycle into DIR'
+    )
+    parser.add_argument(
+        '--json-logs',
+        action='store_true',
+        help='write logs as JSON lines with summary fields'
+    )
+    parser.add_argument(
+        '--debug',
+        action='store_true',
+        help='log raw codes and params of every file'
+    )
+    parser.add_argument(
+        '--preallocate',
+        metavar='DAYS',
+        type=int,
+        default=None,
+        help='create blocks of the next DAYS days while there are no files to handle'
+    )
+    parser.add_argument(
+        '--layout',
+        choices=('insert', 'append'),
+        default='insert',
+        help='insert date blocks in date order or append them at the right edge'
+    )
+    parser.add_argument(
+        '--summary-gid',
+        type=int,
+        default=None,
+        help='sheet for month summaries, required by append layout'
+    )
+    parser.add_argument(
+        '--summary-mode',
+        choices=('terms', 'range'),
+        default='terms',
+        help='month summaries as sums of date columns or one SUMIF over a named range'
+    )
+    parser.add_argument(
+        '--checkpoint-on',
+        choices=('month', 'inventory'),
+        nargs='*',
+        default=(),
+        help='write remainder checkpoints at the last date of every month and/or at every inventory date'
+    )
+    parser.add_argument(
+        '--partition',
+        choices=('month', 'quarter', 'year'),
+        default=None,
+        help='start a new sheet tab with opening balances for every period'
+    )
+    parser.add_argument(
+        '--max-cols',
+        type=int,
+        default=None,
+        help='also start a new sheet tab when the current one is that wide'
+    )
+    parser.add_argument(
+        '--buffer',
+        metavar='PATH',
+        default=None,
+        help='acknowledge files once their operations are saved to PATH and write them in groups'
+    )
+    parser.add_argument(
+        '--buffer-ops',
+        type=int,
+        default=100,
+        help='write buffered operations when that many are collected'
+    )
+    parser.add_argument(
+        '--buffer-seconds',
+        type=float,
+        default=300.0,
+        help='write buffered operations when the oldest one waits that long'
+    )
+    parser.add_argument(
+        '--journal',
+        metavar='PATH',
+        default=None,
+        help='record written files by content hash in SQLite journal PATH and skip files seen again'
+    )
+    parser.add_argument(
+        '--ledger',
+        metavar='PATH',
+        default=None,
+        help='record operations to SQLite ledger PATH and render the spreadsheet from it'
+    )
+    parser.add_argument(
+        '--ledger-import',
+        action='store_true',
+        help='import values of the spreadsheet into the empty --ledger before the first render'
+    )
+    parser.add_argument(
+        '--sales-log',
+        metavar='GID',
+        type=int,
+        default=None,
+        help='append every sale to the sales log sheet GID instead of keeping customers in notes'
+    )
+    parser.add_argument(
+        '--sync-catalog',
+        action='store_true',
+        help='add rows of items.csv products missing in the spreadsheet before handling files'
+    )
+    parser.add_argument(
+        '--report',
+        choices=tuple(REPORTS),
+        default=None,
+        help='write the report built from --ledger without reading the spreadsheet and exit'
+    )
+    parser.add_argument(
+        '--report-output',
+        metavar='PATH',
+        default=None,
+        help='report file, ./reports/<report>.<format> by default'
+    )
+    parser.add_argument(
+        '--report-format',
+        choices=('csv', 'json'),
+        default='csv',
+        help='report file format'
+    )
+    parser.add_argument(
+        '--start',
+        type=datetime.date.fromisoformat,
+        default=None,
+        help='first date of the report, YYYY-MM-DD'
+    )
+    parser.add_argument(
+        '--end',
+        type=datetime.date.fromisoformat,
+        default=None,
+        help='last date of the report, YYYY-MM-DD'
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=10,
+        help='number of products in top-products report'
+    )
+    args = parser.parse_args()
+    if args.report is not None:
+        if args.ledger is None:
+            parser.error('--report requires --ledger')
+        try:
+            make_report(
+                ledger_path=args.ledger,
+                name=args.report,
+                path=args.report_output or f'./reports/{args.report}.{args.report_format}',
+                fmt=args.report_format,
+                start=args.start,
+                end=args.end,
+                limit=args.top,
+            )
+        except (FileNotFoundError, ValueError) as e:
+            parser.error(str(e))
+        parser.exit()
     main(
         customers_path='config/customers.csv',
         items_path='config/items.csv',
@@ -8,5 +173,23 @@ if __name__ == '__main__':
         to_csvs='./handled_csvs/',
         creds_path='./config/credentials.json',
         spreadsheet_id='1I-pZ071d2fb7kR7gkwMBgY0-rk7RbEPisFL9ZoDTKnM',
-        gid=2051596882
+        gid=2051596882,
+        profile_dir=args.profile,
+        json_logs=args.json_logs,
+        log_level=logging.DEBUG if args.debug else logging.INFO,
+        preallocate_days=args.preallocate,
+        layout=args.layout,
+        summary_gid=args.summary_gid,
+        summary_mode=args.summary_mode,
+        checkpoint_on=tuple(args.checkpoint_on),
+        partition_period=args.partition,
+        partition_max_cols=args.max_cols,
+        buffer_path=args.buffer,
+        buffer_max_ops=args.buffer_ops,
+        buffer_max_age=args.buffer_seconds,
+        journal_path=args.journal,
+        ledger_path=args.ledger,
+        ledger_import=args.ledger_import,
+        sales_log_gid=args.sales_log,
+        sync_catalog=args.sync_catalog,
     )
@@ -0,0 +1,331 @@
+import re
+import json
+import datetime
+from contextlib import contextmanager
+from typing import Literal, Any, Callable, Iterable, Iterator
+from google_spreadsheets.api import Cell
+from google_spreadsheets.utils import find_sheet, add_sheet_request, update_cells_requests
+from stock_index import StockIndex
+from spreadsheet import AccountingSpreadsheet, RateLimitWrapper, Shipment, Income, Sale, Inventory, SheetProduct, \
+    SALES_LOG_TITLE, sales_log_requests
+from tracing import tracer
+
+
+Period = Literal['month', 'quarter', 'year']
+
+
+def period_start(date: datetime.date, period: Period) -> datetime.date:
+    """
+    First date of the period containing given date
+    """
+    if period == 'month':
+        return date.replace(day=1)
+    if period == 'quarter':
+        return date.replace(month=(date.month - 1) // 3 * 3 + 1, day=1)
+    return date.replace(month=1, day=1)
+
+
+def next_period_start(date: datetime.date, period: Period) -> datetime.date:
+    """
+    First date of the period following the one containing given date
+    """
+    start = period_start(date, period)
+    month = start.month - 1 + {'month': 1, 'quarter': 3, 'year': 12}[period]
+    return start.replace(year=start.year + month // 12, month=month % 12 + 1)
+
+
+class PartitionedSpreadsheet:
+    """
+    Splits accounting history into sheet tabs by period or width.
+    The gid sheet is the first partition, next ones are titled '<gid sheet title> <first date>'
+    and start with products and opening balances carried over from the previous partition.
+    Every date is routed to the partition of its period, so the active sheet stays narrow
+    """
+    def __init__(self, spreadsheet_id: str, gid: int, creds_path: str, logger=None, period: Period = 'year',
+                 max_cols: int | None = None, **kwargs: Any) -> None:
+        """
+        period - a new partition is started by the first date of a new period
+        max_cols - a new partition is also started by a date after the last one when the sheet is that wide
+        kwargs are passed to AccountingSpreadsheet of every partition
+        """
+        if kwargs.get('layout') == 'append':
+            raise ValueError('append layout keeps month summaries on one sheet, it can not be partitioned')
+        with open(creds_path, encoding='utf8') as file:
+            credentials = json.loads(file.read())
+        self._google = RateLimitWrapper(credentials, spreadsheet_id)
+        self._spreadsheet_id = spreadsheet_id
+        self._creds_path = creds_path
+        self._logger = logger
+        self._period = period
+        self._max_cols = max_cols
+        self._kwargs = kwargs
+        self.gid = gid
+        self._partitions: list[tuple[datetime.date | None, int]] | None = None
+        self._sheets: dict[int, AccountingSpreadsheet] = {}
+        self._batch: list[tuple[str, list, datetime.date]] | None = None
+        self.index = StockIndex()  # shared by all partitions
+
+    @property
+    def partitions(self) -> list[tuple[datetime.date | None, int]]:
+        """
+        (first date, gid) of every partition in date order, first date of the gid sheet is None
+        """
+        if self._partitions is None:
+            title = find_sheet(self._google.sheets, id=self.gid).title
+            pattern = re.compile(re.escape(title) + r' (\d{2}\.\d{2}\.\d{4})')
+            partitions: list[tuple[datetime.date | None, int]] = []
+            for sheet in self._google.sheets:
+                match = pattern.fullmatch(sheet.title)
+                if match is not None:
+                    partitions.append((datetime.datetime.strptime(match.group(1), '%d.%m.%Y').date(), sheet.id))
+            partitions.sort()
+            self._partitions = [(None, self.gid), *partitions]
+        return self._partitions
+
+    def _spreadsheet(self, index: int) -> AccountingSpreadsheet:
+        start, gid = self.partitions[index]
+        if gid not in self._sheets:
+            self._sheets[gid] = AccountingSpreadsheet(
+                self._spreadsheet_id, gid, self._creds_path, self._logger, period_start=start, index=self.index,
+                **self._kwargs
+            )
+        return self._sheets[gid]
+
+    @property
+    def active(self) -> AccountingSpreadsheet:
+        """
+        The last partition, new dates go there
+        """
+        return self._spreadsheet(len(self.partitions) - 1)
+
+    def _index_of(self, date: datetime.date) -> int:
+        index = 0
+        for i, (start, _) in enumerate(self.partitions):
+            if start is None or start <= date:
+                index = i
+        return index
+
+    def partition(self, date: datetime.date) -> AccountingSpreadsheet:
+        """
+        Sheet of the date, starts a new partition when the date opens a new period
+        or the last sheet is wider than max_cols
+        """
+        index = self._index_of(date)
+        if index < len(self.partitions) - 1:
+            return self._spreadsheet(index)
+        sheet = self.active
+        if not sheet.dates or date <= sheet.dates[-1].date:
+            return sheet
+        # opening block of a partition is dated by the previous period
+        last_date = max(sheet.dates[-1].date, self.partitions[-1][0] or sheet.dates[-1].date)
+        if period_start(date, self._period) > period_start(last_date, self._period):
+            return self.roll_over(period_start(date, self._period))
+        if self._max_cols is not None and sheet.width >= self._max_cols:
+            return self.roll_over(date)
+        return sheet
+
+    def roll_over(self, start: datetime.date) -> AccountingSpreadsheet:
+        """
+        Starts a new partition from start date in one batchUpdate:
+        the sheet tab, header and products of the previous partition
+        and a block of its last date with closing balances as plain values
+        """
+        prev = self.active
+        last = prev.dates[-1]
+        balances = prev.closing_balances(last.date)
+        title = f'{find_sheet(self._google.sheets, id=self.gid).title} {start.strftime("%d.%m.%Y")}'
+        gid = max(sheet.id for sheet in self._google.sheets) + 1
+
+        cells = [
+            Cell(value=c.formatted_value or c.value, col_idx=c.col_idx, row_idx=c.row_idx)
+            for c in self._google.get_values(sheet_id=prev.gid, from_='A1', to='D2')
+            if c.value is not None
+        ]
+        for p in prev.products:
+            cells.extend((
+                Cell(value=p.plu, col_idx=0, row_idx=p.row_idx),
+                Cell(value=p.name, col_idx=1, row_idx=p.row_idx),
+                Cell(value=p.price, col_idx=2, row_idx=p.row_idx),
+            ))
+        opening_col_idx = 4
+        cells.append(Cell(value=last.date.strftime('%d.%m.%Y'), col_idx=opening_col_idx, row_idx=0, bold=True))
+        cells.append(Cell(value='Остаток', col_idx=opening_col_idx, row_idx=1))
+        cells.extend(Cell(value=value, col_idx=opening_col_idx, row_idx=row_idx) for row_idx, value in balances.items())
+
+        row_count = max([1000, *(p.row_idx + 1 for p in prev.products)])
+        with tracer.span('roll over', start=start):
+            self._google.batch_update([add_sheet_request(title, gid, row_count), *update_cells_requests(cells, gid)])
+        self._partitions.append((start, gid))
+        if self._logger is not None:
+            self._logger.info(f'Started partition "{title}" with balances of {last.date}')
+        return self.active
+
+    def carry_over(self, since: int) -> None:
+        """
+        Rewrites opening balances of partitions after the since one,
+        as they are plain values copied from the previous partition
+        """
+        for index in range(since + 1, len(self.partitions)):
+            prev, sheet = self._spreadsheet(index - 1), self._spreadsheet(index)
+            if not prev.dates or not sheet.dates:
+                continue
+            sheet.set_opening_balances(prev.closing_balances(prev.dates[-1].date))
+
+    @contextmanager
+    def batch(self, on_written: Callable[[list[list]], None] | None = None) -> Iterator[None]:
+        """
+        Queues writes of the block and applies them on exit with one AccountingSpreadsheet.batch per partition.
+        Partitions are flushed one after another, so a failed flush may leave earlier partitions written,
+        on_written is called for the operations of every partition once they are written
+        """
+        if self._batch is not None:
+            yield
+            return
+        operations: list[tuple[str, list, datetime.date]] = []
+        self._batch = operations
+        try:
+            yield
+        finally:
+            self._batch = None
+        routed: dict[int, list[tuple[str, list, datetime.date]]] = {}
+        for method, items, date in operations:
+            self.partition(date)
+            routed.setdefault(self._index_of(date), []).append((method, items, date))
+        since = None
+        for index, partition_operations in sorted(routed.items()):
+            sheet = self._spreadsheet(index)
+            with sheet.batch(on_written):
+                for method, items, date in partition_operations:
+                    getattr(sheet, method)(items, date)
+            if any(method != 'create_shipment' for method, _, _ in partition_operations):
+                since = index if since is None else since
+        if since is not None and since < len(self.partitions) - 1:
+            self.carry_over(since)
+
+    def _write(self, method: str, items: list, date: datetime.date | None) -> None:
+        if date is None:
+            date = datetime.datetime.now().date()
+        if self._batch is not None:
+            self.rows_of(items)
+            self._batch.append((method, items, date))
+            return
+        sheet = self.partition(date)
+        getattr(sheet, method)(items, date)
+        index = self._index_of(date)
+        if method != 'create_shipment' and index < len(self.partitions) - 1:
+            self.carry_over(index)
+
+    def create_shipment(self, shipments: list[Shipment], date: datetime.date | None = None):
+        self._write('create_shipment', shipments, date)
+
+    def create_income(self, incomes: list[Income], date: datetime.date | None = None):
+        self._write('create_income', incomes, date)
+
+    def create_sale(self, sales: list[Sale], date: datetime.date | None = None):
+        self._write('create_sale', sales, date)
+
+    def do_inventory(self, inventories: list[Inventory], date: datetime.date | None = None):
+        self._write('do_inventory', inventories, date)
+
+    def render(self, totals: dict[datetime.date, dict]) -> None:
+        """
+        Renders ledger totals into the partitions of their dates, see AccountingSpreadsheet.render
+        """
+        if not totals:
+            return
+        routed: dict[int, dict[datetime.date, dict]] = {}
+        for date in sorted(totals):
+            self.partition(date)
+            routed.setdefault(self._index_of(date), {})[date] = totals[date]
+        for index, partition_totals in sorted(routed.items()):
+            self._spreadsheet(index).render(partition_totals)
+        since = min(routed)
+        if since < len(self.partitions) - 1:
+            self.carry_over(since)
+
+    def read_totals(self) -> dict[datetime.date, dict]:
+        """
+        Operations of all partitions as ledger totals, see AccountingSpreadsheet.read_totals
+        """
+        totals: dict[datetime.date, dict] = {}
+        for index in range(len(self.partitions)):
+            totals.update(self._spreadsheet(index).read_totals())
+        return totals
+
+    def preallocate_dates(self, start: datetime.date, end: datetime.date) -> list:
+        """
+        Preallocates dates in the partitions they belong to, starting new ones if needed
+        """
+        created = []
+        day = start
+        while day <= end:
+            sheet = self.partition(day)
+            index = self._index_of(day)
+            if index < len(self.partitions) - 1:
+                next_start = self.partitions[index + 1][0]
+            else:
+                next_start = next_period_start(day, self._period)
+            until = min(end, next_start - datetime.timedelta(days=1))
+            created.extend(sheet.preallocate_dates(day, until))
+            day = until + datetime.timedelta(days=1)
+        return created
+
+    @property
+    def products(self) -> list[SheetProduct]:
+        return self.active.products
+
+    def _ensure_index(self) -> None:
+        """
+        Loads the shared stock index from values of all partitions once, if it was not loaded from a ledger
+        """
+        if not self.index.loaded:
+            with tracer.span('load index'):
+                self.index.load(self.read_totals())
+
+    def stock(self, plu: int, date: datetime.date) -> int | float:
+        self._ensure_index()
+        return self.index.stock(plu, date)
+
+    def sales(self, plu: int, start: datetime.date, end: datetime.date, customer: str | None = None) -> int | float:
+        self._ensure_index()
+        return self.index.sales(plu, start, end, customer)
+
+    def provision_products(self, catalog: dict[int, tuple[str, int | float]]) -> list[SheetProduct]:
+        """
+        Adds missing catalog products to the active partition and to the loaded ones,
+        see AccountingSpreadsheet.provision_products. Returns products added to the active one
+        """
+        active = self.active
+        for sheet in self._sheets.values():
+            if sheet is not active:
+                sheet.provision_products(catalog)
+        return active.provision_products(catalog)
+
+    def create_sales_log(self, title: str = SALES_LOG_TITLE) -> int:
+        """
+        Creates the sales log shared by all partitions, see AccountingSpreadsheet.create_sales_log
+        """
+        gid = max(sheet.id for sheet in self._google.sheets) + 1
+        with tracer.span('create sales log'):
+            self._google.batch_update(sales_log_requests(title, gid))
+        self._kwargs['sales_log_gid'] = gid
+        for sheet in self._sheets.values():
+            sheet.sales_log_gid = gid
+        return gid
+
+    @property
+    def plu_index(self) -> dict[int, int]:
+        return self.active.plu_index
+
+    def rows_of(self, items: Iterable[Shipment | Income | Sale | Inventory]) -> dict[int, int]:
+        return self.active.rows_of(items)
+
+    def validate_layout(self) -> bool:
+        return all([sheet.validate_layout() for sheet in self._sheets.values()])
+
+    def warm_up(self) -> None:
+        self.active.warm_up()
+
+    def remember_layout(self) -> None:
+        for sheet in self._sheets.values():
+            sheet.remember_layout()
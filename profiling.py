@@ -0,0 +1,107 @@
+import pstats
+import cProfile
+import datetime
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager, nullcontext
+from typing import Iterator, ContextManager
+
+
+class Profiler:
+    """
+    Profiles ingest cycles: cProfile per handled file and
+    tracemalloc snapshots around spreadsheet warm-up.
+    Every cycle gets its own directory inside given one
+    """
+    def __init__(self, directory: str | Path, top: int = 30) -> None:
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._top = top
+        self._cycle = 0
+        self._cycle_dir: Path | None = None
+        self._stats_paths: list[Path] = []
+
+    @property
+    def cycle_dir(self) -> Path:
+        if self._cycle_dir is None:
+            self.next_cycle()
+        return self._cycle_dir
+
+    def next_cycle(self) -> Path:
+        """
+        Finish current cycle and start a new directory for the next one
+        """
+        self.finish_cycle()
+        self._cycle += 1
+        stamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        self._cycle_dir = self._directory / f'cycle_{self._cycle:04d}_{stamp}'
+        self._cycle_dir.mkdir(parents=True, exist_ok=True)
+        return self._cycle_dir
+
+    @contextmanager
+    def profile_file(self, name: str) -> Iterator[None]:
+        """
+        Run cProfile around the block and dump stats to <cycle>/<name>.pstats
+        """
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            path = self.cycle_dir / f'{Path(name).stem}.pstats'
+            profile.dump_stats(path)
+            self._stats_paths.append(path)
+
+    @contextmanager
+    def trace_allocations(self, name: str) -> Iterator[None]:
+        """
+        Take tracemalloc snapshots before and after the block
+        and write top allocation differences to <cycle>/<name>_allocations.txt
+        """
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(10)
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            if started_here:
+                tracemalloc.stop()
+            stats = after.compare_to(before, 'lineno')
+            path = self.cycle_dir / f'{name}_allocations.txt'
+            with open(path, 'w', encoding='utf8') as file:
+                file.write(f'Top {self._top} allocations by size difference\n')
+                for stat in stats[:self._top]:
+                    file.write(f'{stat}\n')
+
+    def finish_cycle(self) -> None:
+        """
+        Merge stats of all files of the cycle into <cycle>/summary.txt
+        """
+        if self._cycle_dir is None or not self._stats_paths:
+            return
+        path = self._cycle_dir / 'summary.txt'
+        with open(path, 'w', encoding='utf8') as file:
+            stats = pstats.Stats(*map(str, self._stats_paths), stream=file)
+            stats.sort_stats('cumulative').print_stats(self._top)
+            stats.sort_stats('tottime').print_stats(self._top)
+        self._stats_paths = []
+
+
+class NullProfiler:
+    """
+    Profiler stub used when profiling is off
+    """
+    def next_cycle(self) -> None:
+        return None
+
+    def profile_file(self, name: str) -> ContextManager[None]:
+        return nullcontext()
+
+    def trace_allocations(self, name: str) -> ContextManager[None]:
+        return nullcontext()
+
+    def finish_cycle(self) -> None:
+        return None
@@ -0,0 +1,66 @@
+import csv
+import json
+import datetime
+from pathlib import Path
+from ledger import Ledger
+
+
+REPORTS = {
+    'daily-sales': ('date', 'customer', 'weight'),
+    'write-offs': ('month', 'customer', 'weight'),
+    'top-products': ('plu', 'weight'),
+}
+
+
+def build_report(ledger: Ledger, name: str, start: datetime.date | None = None, end: datetime.date | None = None,
+                 limit: int = 10) -> list[dict]:
+    """
+    Rows of the report aggregated from the ledger, the spreadsheet is not read
+    """
+    if name == 'daily-sales':
+        return ledger.daily_sales(start, end)
+    if name == 'write-offs':
+        return ledger.monthly_write_offs(start, end)
+    if name == 'top-products':
+        return ledger.top_products(start, end, limit)
+    raise ValueError(f'Unknown report {name}, expected one of {", ".join(REPORTS)}')
+
+
+def write_report(rows: list[dict], name: str, path: str | Path, fmt: str = 'csv') -> None:
+    """
+    Writes report rows to csv or json file in one pass
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf8', newline='') as file:
+        if fmt == 'csv':
+            writer = csv.DictWriter(file, fieldnames=REPORTS[name], delimiter=';')
+            writer.writeheader()
+            writer.writerows(rows)
+        elif fmt == 'json':
+            json.dump(rows, file, ensure_ascii=False, indent=2)
+        else:
+            raise ValueError(f'Unknown report format {fmt}, expected csv or json')
+
+
+def make_report(ledger_path: str | Path, name: str, path: str | Path, fmt: str = 'csv',
+                start: datetime.date | None = None, end: datetime.date | None = None, limit: int = 10) -> int:
+    """
+    Builds the report from the ledger at ledger_path and writes it to path.
+    Raises FileNotFoundError if there is no ledger and ValueError if it has no operations,
+    as a report of an empty ledger would be empty whatever the spreadsheet has.
+    Returns number of rows
+    """
+    if not Path(ledger_path).exists():
+        raise FileNotFoundError(f'No ledger {ledger_path}, reports are built from operations recorded with --ledger')
+    ledger = Ledger(ledger_path)
+    try:
+        if not len(ledger):
+            raise ValueError(
+                f'Ledger {ledger_path} has no operations, record them with --ledger '
+                f'(values already in the spreadsheet are imported with --ledger-import)'
+            )
+        rows = build_report(ledger, name, start, end, limit)
+    finally:
+        ledger.close()
+    write_report(rows, name, path, fmt)
+    return len(rows)
@@ -2,16 +2,80 @@ from pprint import pprint
 
 import time
 import json
+import bisect
+import hashlib
 import datetime
-from typing import TypeVar, Literal, Any
+from typing import TypeVar, Literal, Any, Callable, Iterable, Iterator
+from contextlib import contextmanager
 from dataclasses import dataclass
 from google_spreadsheets.api import GoogleSheets, Cell
 from google_spreadsheets.Dataclasses import Borders, RightBorder
+from google_spreadsheets.utils import find_sheet, columns_metadata, grid_range, add_named_range_request, \
+    update_cells_requests, insert_dimension_request, merge_cells_request, add_sheet_request, append_cells_request, \
+    pivot_table_request
+from stock_index import StockIndex, round_weight
+from tracing import tracer
 
 
 ColIdx = TypeVar('ColIdx', bound=int)
 RowIdx = TypeVar('RowIdx', bound=int)
 
+LAYOUT_METADATA_KEY = 'accounting_block'
+LAYOUT_SCHEMA_VERSION = 1
+
+# sub-columns of a new date block in their order
+DATE_COLS = (
+    'Отгрузка',
+    'Приход',
+    'Реализация',
+    'Реализация сумма',
+    'Гл. Дом',
+    'Кинологи',
+    'Благотворительность',
+    'Утилизация',
+    'Остаток',
+)
+
+# sub-columns of month summary block in their order
+MONTH_COLS = (
+    'Отгрузка',
+    'Приход',
+    'Реализация',
+    'Реализация сумма',
+    'Гл. Дом',
+    'Кинологи',
+    'Благотворительность',
+    'Утилизация',
+)
+MONTH_OFFSETS = {name: offset for offset, name in enumerate(MONTH_COLS)}
+
+# month summary formula of 'range' summary mode, sums columns of the month
+# named range whose sub-header (first row of the range) equals the summary column name
+RANGE_SUMMARY_FORMULA = '=СУММЕСЛИ(ИНДЕКС({range}; 1; 0); "{name}"; ИНДЕКС({range}; СТРОКА()-1; 0))'
+
+# sub-columns read by each kind of write, the first one is written by increment writes
+OPERATION_COLS = {
+    'shipment': ('Отгрузка',),
+    'income': ('Приход',),
+    'sale': ('Реализация', 'Реализация сумма', 'Гл. Дом', 'Кинологи', 'Благотворительность', 'Утилизация'),
+    'inventory': ('Инвентаризация',),
+}
+
+# sale customers which have their own sub-column
+SALE_CUSTOMER_COLS = ('Гл. Дом', 'Кинологи', 'Благотворительность', 'Утилизация')
+
+# columns of the sales log sheet, one row per sale
+SALES_LOG_HEADER = ('Дата', 'PLU', 'Покупатель', 'Вес')
+SALES_LOG_TITLE = 'Продажи по покупателям'
+# with the sales log values are written without notes, so notes written before it are kept
+SALES_LOG_FIELDS = 'userEnteredValue,userEnteredFormat'
+
+# column with remainders frozen as plain values, next date starts its chain from it
+CHECKPOINT_COL = 'Контрольный остаток'
+
+# cells a gap between touched rows may have before it is cheaper to read it as a separate range
+RANGE_COST_CELLS = 50
+
 SEASONS = (
     'Январь',
     'Февраль',
@@ -28,6 +92,66 @@ SEASONS = (
 )
 
 
+def plan_reads(rows: Iterable[RowIdx], cols: Iterable[ColIdx],
+               range_cost: int = RANGE_COST_CELLS) -> list[tuple[Cell, Cell]]:
+    """
+    Covers touched rows over the span of cols with few ranges.
+    Rows are read one rectangle per run, neighbour runs are joined
+    while the cells of the gap between them cost less than one more range
+    """
+    rows = sorted(set(rows))
+    cols = [c for c in cols if c is not None]
+    if not rows or not cols:
+        return []
+    first_col_idx, last_col_idx = min(cols), max(cols)
+    width = last_col_idx - first_col_idx + 1
+    runs = [[rows[0], rows[0]]]
+    for row_idx in rows[1:]:
+        if (row_idx - runs[-1][1] - 1) * width <= range_cost:
+            runs[-1][1] = row_idx
+        else:
+            runs.append([row_idx, row_idx])
+    return [
+        (Cell(col_idx=first_col_idx, row_idx=start), Cell(col_idx=last_col_idx, row_idx=end)) for start, end in runs
+    ]
+
+
+def sales_log_requests(title: str, gid: int) -> list[dict]:
+    """
+    Requests creating the sales log sheet with a header at gid and the next sheet
+    with its pivot table of weights by customer and PLU
+    """
+    header = [Cell(value=name, col_idx=col_idx, row_idx=0, bold=True) for col_idx, name in enumerate(SALES_LOG_HEADER)]
+    customer_offset, plu_offset, weight_offset = (SALES_LOG_HEADER.index(name) for name in ('Покупатель', 'PLU', 'Вес'))
+    return [
+        add_sheet_request(title, gid),
+        add_sheet_request(f'{title} итоги', gid + 1),
+        *update_cells_requests(header, gid),
+        pivot_table_request(
+            grid_range(gid, start_col=0, end_col=len(SALES_LOG_HEADER)), gid + 1,
+            rows=(customer_offset, plu_offset), values=((weight_offset, 'Вес'),)
+        ),
+    ]
+
+
+def _month_order(sheet_month: 'SheetMonth') -> tuple[int, int]:
+    return sheet_month.year or 0, sheet_month.month
+
+
+def parse_number(value: Any) -> int | float:
+    """
+    Converts cell value or formatted value to number, empty value is 0
+    """
+    if value is None or value == '':
+        return 0
+    if isinstance(value, str):
+        value = value.replace('\xa0', '').replace(' ', '').replace(',', '.')
+        if value.lstrip('-').isdigit():
+            return int(value)
+        return float(value)
+    return value
+
+
 @dataclass
 class SheetProduct:
     plu: int
@@ -43,24 +167,52 @@ class UnderDateColumn:
     name: str
 
 
+def col_offsets(names: Iterable[str | None]) -> dict[str, int]:
+    """
+    Maps sub-column names to their offsets from the first column of a block, empty names are skipped.
+    The first of repeated names wins
+    """
+    offsets: dict[str, int] = {}
+    for offset, name in enumerate(names):
+        if name is not None and name != '':
+            offsets.setdefault(name, offset)
+    return offsets
+
+
 class SheetBase:
     def add_col_idx(self, num: int):
+        # offsets are relative to col_idx, so sub-columns move with it
         self.col_idx += num
-        if self.cols is not None:
-            for under_date_col in self.cols:
-                under_date_col.col_idx += num
 
     def find_col_idx(self, name: str) -> ColIdx | None:
-        if self.cols is None:
-            raise TypeError('cols attr is None')
-        for col in self.cols:
-            if col.name == name:
-                return col.col_idx
-        return None
+        if self.offsets is None:
+            raise TypeError('offsets attr is None')
+        offset = self.offsets.get(name)
+        if offset is None:
+            return None
+        return self.col_idx + offset
+
+    @property
+    def cols(self) -> list[UnderDateColumn] | None:
+        if self.offsets is None:
+            return None
+        return [UnderDateColumn(col_idx=self.col_idx + offset, row_idx=1, name=name) for name, offset in self.offsets.items()]
 
     def to_cell(self, value: Any = None) -> Cell:
         return Cell(value=value, col_idx=self.col_idx, row_idx=self.row_idx)
 
+    def block_key(self) -> str:
+        raise NotImplementedError()
+
+    def metadata(self) -> dict[str, Any]:
+        return {'block': self.block_key(), 'wide': self.wide, 'schema': LAYOUT_SCHEMA_VERSION}
+
+    def metadata_value(self) -> str:
+        """
+        Fingerprint stored in developer metadata of the block columns
+        """
+        return json.dumps(self.metadata())
+
 
 @dataclass
 class SheetDate(SheetBase):
@@ -69,7 +221,11 @@ class SheetDate(SheetBase):
     col_idx: RowIdx
     row_idx: ColIdx
     wide: int = 1
-    cols: list[UnderDateColumn] | None = None
+    offsets: dict[str, int] | None = None
+    meta_id: int | None = None
+
+    def block_key(self) -> str:
+        return f'date:{self.date.isoformat()}'
 
 
 @dataclass
@@ -80,11 +236,24 @@ class SheetMonth(SheetBase):
     row_idx: RowIdx
     month: int = -1
     wide: int = 1
-    cols: list[UnderDateColumn] | None = None
+    offsets: dict[str, int] | None = None
+    meta_id: int | None = None
+    year: int | None = None  # year of the summarized dates, None if the block has none
+    range_name: str | None = None  # named range of the 'range' summary mode, kept in block metadata
 
     def __post_init__(self):
         self.month = SEASONS.index(self.name) + 1
 
+    def block_key(self) -> str:
+        if self.year is None:
+            return f'month:{self.month}'
+        return f'month:{self.year}-{self.month:02d}'
+
+    def metadata(self) -> dict[str, Any]:
+        if self.range_name is None:
+            return super().metadata()
+        return {**super().metadata(), 'range': self.range_name}
+
 
 @dataclass
 class Shipment:
@@ -114,15 +283,16 @@ class Inventory:
 class RateLimitWrapper(GoogleSheets):
     def _dec(self, method):
         def inner(*args, **kwargs):
-            while True:
-                try:
-                    return method(*args, **kwargs)
-                except Exception as e:
-                    if 'RATE_LIMIT_EXCEEDED' in str(e):
-                        time.sleep(5)
-                        continue
-                    else:
-                        raise e
+            with tracer.span(method.__name__, cat='http'):
+                while True:
+                    try:
+                        return method(*args, **kwargs)
+                    except Exception as e:
+                        if 'RATE_LIMIT_EXCEEDED' in str(e):
+                            time.sleep(5)
+                            continue
+                        else:
+                            raise e
         return inner
 
     def __getattribute__(self, __name: str):
@@ -136,7 +306,29 @@ class AccountingSpreadsheet:
     """
     Class implements methods to manipulate accounting google spreadsheet
     """
-    def __init__(self, spreadsheet_id: str, gid: int, creds_path: str, logger=None, summarize_forward: bool = True) -> None:
+    def __init__(self, spreadsheet_id: str, gid: int, creds_path: str, logger=None, summarize_forward: bool = True,
+                 check_drift: bool = True, summary_mode: Literal['terms', 'range'] = 'terms',
+                 checkpoint_on: tuple[Literal['month', 'inventory'], ...] = (),
+                 layout: Literal['insert', 'append'] = 'insert', summary_gid: int | None = None,
+                 period_start: datetime.date | None = None, index: StockIndex | None = None,
+                 sales_log_gid: int | None = None) -> None:
+        """
+        layout - 'insert' keeps date blocks in date order with month summaries after their dates,
+        'append' adds date blocks at the right edge in arrival order and keeps month summaries
+        on the summary_gid sheet, so no write shifts existing columns.
+        period_start - first date of the sheet when it is a partition (see partitions.py),
+        earlier dates are opening balances and can not be created.
+        index - stock index fed with applied operations, a new one if not given.
+        sales_log_gid - sheet where every sale is appended as a row (see create_sales_log),
+        then notes of sale cells are not parsed and rewritten
+        """
+        if layout == 'append':
+            if summary_gid is None:
+                raise ValueError('summary_gid is required for append layout')
+            if summary_mode == 'range':
+                raise ValueError('range summary mode needs adjacent date blocks of a month, use terms with append layout')
+            if checkpoint_on:
+                raise ValueError('checkpoints insert columns inside date blocks, they are not supported by append layout')
         with open(creds_path, encoding='utf8') as file:
             credentials_str = file.read()
         credentials = json.loads(credentials_str)
@@ -144,109 +336,361 @@ class AccountingSpreadsheet:
         self.gid = gid
         self._dates: list[SheetDate] | None = None
         self._products: list[SheetProduct] | None = None
+        self._plu_index: dict[int, RowIdx] | None = None
         self._months: list[SheetMonth] | None = None
+        self._month_blocks: dict[tuple[int | None, int], SheetMonth] = {}
         self._logger = logger
         self._summarize_forward = summarize_forward
-
-        # call post init method
-        self._post_init()
+        self._check_drift = check_drift
+        self._summary_mode = summary_mode
+        self._checkpoint_on = checkpoint_on
+        self._layout = layout
+        self.summary_gid = summary_gid
+        self.period_start = period_start
+        self._right_edge: ColIdx | None = None
+        self._named_ranges: dict[str, dict] | None = None
+        self._post_init_done = False
+        self._fingerprint: str | None = None
+        self._layout_changed = False
+        self._month_refs: dict[str, dict[str, tuple[str, ...]]] = {}  # by block key
+        self._remainder_signatures: dict[str, tuple] = {}
+        self._remainder_rows: dict[str, set[RowIdx]] = {}
+        self._pending_cells: dict[tuple[ColIdx, RowIdx], Cell] = {}
+        self._pending_signatures: dict[str, tuple[tuple, set[RowIdx]]] = {}
+        self._batch: list[tuple[str, list, datetime.date]] | None = None
+        self.index = index if index is not None else StockIndex()
+        self.sales_log_gid = sales_log_gid
 
     def _post_init(self):
+        self._post_init_done = True
+        if self.period_start is not None and (not self.dates or self.dates[-1].date < self.period_start):
+            return  # partition has opening balances only
         if self._summarize_forward is True:
             self.summarize_month('last_date', update_exist=False)
 
+    def _ensure_post_init(self):
+        """
+        Runs post init work once, right before the first write
+        """
+        if not self._post_init_done:
+            self._post_init()
+
+    def warm_up(self) -> None:
+        """
+        Loads layout and products and runs post init work if it was not done yet
+        """
+        self.products
+        self.dates
+        self._ensure_post_init()
+
+    @property
+    def width(self) -> int:
+        """
+        Number of columns taken by the layout
+        """
+        return max((b.col_idx + b.wide for b in (*self.dates, *self.months)), default=0)
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._dates is not None or self._products is not None
+
+    def invalidate(self) -> None:
+        """
+        Drops cached layout, it will be rediscovered on next access
+        """
+        self._dates = None
+        self._months = None
+        self._month_blocks = {}
+        self._products = None
+        self._plu_index = None
+        self._right_edge = None
+        self._fingerprint = None
+        self._post_init_done = False
+        self._layout_changed = False
+        self._month_refs = {}
+        self._named_ranges = None
+        self._remainder_signatures = {}
+        self._remainder_rows = {}
+        self._pending_cells = {}
+        self._pending_signatures = {}
+
+    def _fetch_fingerprint(self) -> str:
+        """
+        Hash of header rows and PLU column read in one request without grid data.
+        Header rows of the month summary sheet are hashed too if the summaries are on their own sheet
+        """
+        title = find_sheet(self._google.sheets, id=self.gid).title
+        ranges = [f"'{title}'!1:2", f"'{title}'!A:A"]
+        if self.months_gid != self.gid:
+            months_title = find_sheet(self._google.sheets, id=self.months_gid).title
+            ranges.extend([f"'{months_title}'!1:2", f"'{months_title}'!A:A"])
+        values = self._google.get_formatted_values(ranges)
+        return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode('utf8')).hexdigest()
+
+    def validate_layout(self) -> bool:
+        """
+        Compares sheet fingerprint with the one remembered for cached layout.
+        Drops caches and returns False if the sheet was changed by someone else.
+        Makes no requests if nothing is cached yet
+        """
+        if not self.is_loaded:
+            return True
+        fingerprint = self._fetch_fingerprint()
+        if self._fingerprint is not None and fingerprint == self._fingerprint:
+            return True
+        if self._logger is not None:
+            self._logger.info('Spreadsheet layout was changed, cached layout is dropped')
+        self.invalidate()
+        return False
+
+    def remember_layout(self) -> None:
+        """
+        Stores fingerprint of current layout if it was loaded or changed by us since last time
+        """
+        if not self.is_loaded:
+            return
+        if self._fingerprint is None or self._layout_changed:
+            self._fingerprint = self._fetch_fingerprint()
+            self._layout_changed = False
+
+    @property
+    def months_gid(self) -> int:
+        """
+        Sheet holding month summaries
+        """
+        return self.summary_gid if self._layout == 'append' else self.gid
+
+    def _block_metadata(self, block: SheetDate | SheetMonth) -> dict:
+        sheet_id = self.months_gid if isinstance(block, SheetMonth) else self.gid
+        return columns_metadata(
+            sheet_id, block.col_idx, block.col_idx + block.wide, LAYOUT_METADATA_KEY, block.metadata_value()
+        )
+
+    def _date_ref(self, col_idx: ColIdx, row_idx: RowIdx) -> str:
+        """
+        Reference to a cell of the dates sheet from the month summaries sheet
+        """
+        name = Cell(col_idx=col_idx, row_idx=row_idx).name
+        if self.months_gid == self.gid:
+            return name
+        return f"'{find_sheet(self._google.sheets, id=self.gid).title}'!{name}"
+
+    def _blocks_around(self, date: datetime.date) -> list[SheetDate | SheetMonth]:
+        """
+        Blocks a write to given date may touch: dates of its month, their neighbours and month summary
+        """
+        blocks: list[SheetDate | SheetMonth] = []
+        for i, sd in enumerate(self.dates):
+            if sd.date.month == date.month and sd.date.year == date.year:
+                if not blocks and i > 0:
+                    blocks.append(self.dates[i - 1])
+                blocks.append(sd)
+            elif blocks:
+                blocks.append(sd)
+                break
+        if not blocks and self.dates:
+            blocks.append(self.dates[-1])
+        sheet_month = self.month_block(date.month, date.year)
+        if sheet_month is not None:
+            blocks.append(sheet_month)
+        return blocks
+
+    def tag_layout(self, blocks: list[SheetDate | SheetMonth] | None = None) -> list[SheetDate | SheetMonth]:
+        """
+        Links blocks to their developer metadata, creating or fixing it where needed.
+        Positions of cached blocks are trusted here.
+        Returns blocks which got linked by this call
+        """
+        if blocks is None:
+            blocks = [*self.dates, *self.months]
+        untagged = [b for b in blocks if b.meta_id is None]
+        if not untagged:
+            return []
+        existing = self._google.search_developer_metadata([
+            {
+                'developerMetadataLookup': {
+                    'metadataKey': LAYOUT_METADATA_KEY,
+                    'metadataLocation': {'sheetId': sheet_id},
+                    'locationMatchingStrategy': 'INTERSECTING_LOCATION',
+                }
+            }
+            for sheet_id in dict.fromkeys((self.gid, self.months_gid))
+        ])
+        by_block: dict[str, tuple[dict, dict]] = {}
+        for m in existing:
+            try:
+                value = json.loads(m['metadataValue'])
+                by_block[value['block']] = m, value
+            except (KeyError, ValueError):
+                continue
+
+        to_create: list[SheetDate | SheetMonth] = []
+        to_update: list[dict] = []
+        for b in untagged:
+            m, value = by_block.get(b.block_key(), (None, None))
+            if m is None:
+                to_create.append(b)
+                continue
+            b.meta_id = m['metadataId']
+            if isinstance(b, SheetMonth) and b.range_name is None:
+                b.range_name = value.get('range')
+            expected = self._block_metadata(b)
+            if m.get('location') != expected['location'] or m.get('metadataValue') != expected['metadataValue']:
+                to_update.append({'metadataId': b.meta_id, **expected})
+        if to_update:
+            self._google.update_developer_metadata(to_update)
+        if to_create:
+            created = self._google.create_developer_metadata([self._block_metadata(b) for b in to_create])
+            for b, m in zip(to_create, created):
+                b.meta_id = m['metadataId']
+        return untagged
+
+    def _retag(self, block: SheetDate | SheetMonth) -> None:
+        """
+        Updates metadata of the block after we changed its wide
+        """
+        if block.meta_id is not None:
+            self._google.update_developer_metadata([{'metadataId': block.meta_id, **self._block_metadata(block)}])
+
+    def detect_drift(self, date: datetime.date) -> list[SheetDate | SheetMonth]:
+        """
+        Checks with one developerMetadata.search call that blocks around the date
+        are still where cached layout expects them.
+        Moved blocks get new position and their columns are re-read lazily.
+        Returns moved blocks
+        """
+        blocks = self._blocks_around(date)
+        just_tagged = self.tag_layout(blocks)
+        to_check = [b for b in blocks if b not in just_tagged and b.meta_id is not None]
+        if not to_check:
+            return []
+        found = self._google.search_developer_metadata([
+            {'developerMetadataLookup': {'metadataId': b.meta_id}} for b in to_check
+        ])
+        locations = {m['metadataId']: m['location'].get('dimensionRange', {}) for m in found}
+        moved: list[SheetDate | SheetMonth] = []
+        for b in to_check:
+            dimension_range = locations.get(b.meta_id)
+            if dimension_range is None:  # block columns were deleted
+                if self._logger is not None:
+                    self._logger.warning(f'Block {b.block_key()} is lost, cached layout is dropped')
+                self.invalidate()
+                return []
+            start_idx, end_idx = dimension_range['startIndex'], dimension_range['endIndex']
+            if start_idx != b.col_idx or end_idx - start_idx != b.wide:
+                b.col_idx = start_idx
+                b.wide = end_idx - start_idx
+                b.offsets = None
+                moved.append(b)
+        if moved:
+            self._layout_changed = True
+            if self._logger is not None:
+                self._logger.info(f'Blocks were moved by hand: {", ".join(b.block_key() for b in moved)}')
+        return moved
+
     def _binary_dates_srch(self, target: datetime.date) -> int | None:
         """
         self._dates binary search
         """
         if target is None:
             return None
-        # Check base case
-        for i, sd in enumerate(self.dates):
-            if sd.date == target:
-                return i
+        i = bisect.bisect_left(self.dates, target, key=lambda sd: sd.date)
+        if i < len(self.dates) and self.dates[i].date == target:
+            return i
         return None
 
+    def _new_sheet_date(self, target: datetime.date, col_idx: ColIdx) -> SheetDate:
+        """
+        Block of a date which is not written yet.
+        In append layout it has inventory column up front, as columns can not be added later
+        """
+        names = DATE_COLS if self._layout == 'insert' else (*DATE_COLS, 'Инвентаризация')
+        return SheetDate(
+            date=target,
+            col_idx=col_idx,
+            row_idx=0,
+            wide=len(names),
+            offsets=col_offsets(names),
+        )
+
+    def _new_sheet_month(self, month: int, col_idx: ColIdx, year: int | None = None) -> SheetMonth:
+        """
+        Month summary block which is not written yet
+        """
+        return SheetMonth(
+            name=SEASONS[month - 1],
+            col_idx=col_idx,
+            row_idx=0,
+            month=month,
+            wide=len(MONTH_COLS),
+            offsets=col_offsets(MONTH_COLS),
+            year=year,
+            range_name=self._range_name(month, year) if self._summary_mode == 'range' else None,
+        )
+
+    def _header_requests(self, block: SheetDate | SheetMonth, sheet_id: int) -> list[dict]:
+        """
+        Title and sub-column names of a new block, date title is merged over the block
+        """
+        title = block.to_cell(block.date.strftime('%d.%m.%Y') if isinstance(block, SheetDate) else block.name)
+        title.bold = True
+        cells = [title, *(Cell(value=c.name, col_idx=c.col_idx, row_idx=c.row_idx) for c in block.cols)]
+        requests = []
+        if isinstance(block, SheetDate):
+            requests.append(merge_cells_request(grid_range(
+                sheet_id, start_row=0, end_row=1, start_col=block.col_idx, end_col=block.col_idx + block.wide
+            )))
+        return [*requests, *update_cells_requests(cells, sheet_id)]
+
+    def _append_date(self, target: datetime.date) -> int | None:
+        """
+        Append layout: puts the date block at the right edge whatever the date is
+        and keeps self.dates sorted by date, so no existing column moves
+        """
+        if self._binary_dates_srch(target) is not None:
+            return None
+        sheet_date = self._new_sheet_date(target, self._right_edge)
+        requests = [
+            insert_dimension_request(self.gid, 'COLUMNS', sheet_date.col_idx, sheet_date.col_idx + sheet_date.wide),
+            *self._header_requests(sheet_date, self.gid),
+            {'createDeveloperMetadata': {'developerMetadata': self._block_metadata(sheet_date)}},
+        ]
+        self._layout_changed = True
+        response = self._google.batch_update(requests)
+        sheet_date.meta_id = response['replies'][-1]['createDeveloperMetadata']['developerMetadata']['metadataId']
+        self._right_edge += sheet_date.wide
+        index = bisect.bisect(self.dates, target, key=lambda sd: sd.date)
+        self.dates.insert(index, sheet_date)
+        return index
+
     def _insert_date(self, target: datetime.date) -> int | None:
         """
         Inserts date if self.dates does not contain it
         """
-        for i, sd in enumerate(self.dates):
-            if target == sd.date:
-                return None
-            if target < sd.date:
-                index = i
-                break
-        else:
-            index = i + 1
+        if self._layout == 'append':
+            return self._append_date(target)
+        index = bisect.bisect_left(self.dates, target, key=lambda sd: sd.date)
+        if index < len(self.dates) and self.dates[index].date == target:
+            return None
 
         high = index
         prev_idx = index - 1
         prev_sheet_date = self.dates[prev_idx]
-        month_idx = [m.month for m in self.months].index(prev_sheet_date.date.month)
-        month = self.months[month_idx]
-        sheet_month: SheetMonth | None = None
-        add = 0 if prev_sheet_date.date.month == target.month else month.wide
-        row_count, _ = self._google.get_size_of_sheet(self.gid)
-        range_cells = (  # from to shift
-            Cell(col_idx=prev_sheet_date.col_idx + prev_sheet_date.wide + add, row_idx=prev_sheet_date.row_idx), # noqa
-            Cell(col_idx=prev_sheet_date.col_idx + prev_sheet_date.wide + add + 8, row_idx=prev_sheet_date.row_idx + row_count), # noqa
-        )
-        insert_range = lambda: self._google.insert_range( # noqa
-                from_cell=range_cells[0],
-                to_cell=range_cells[1],
-                shift_dimension='COLUMNS',
-                sheet_id=self.gid
-            )
-        self._google.append_dimension('COLUMNS', self.gid, 9)
-        insert_range()
-        from_cell, to_cell = (
-            Cell(col_idx=prev_sheet_date.col_idx + prev_sheet_date.wide + add, row_idx=prev_sheet_date.row_idx), # noqa
-            Cell(col_idx=prev_sheet_date.col_idx + prev_sheet_date.wide + 8 + add, row_idx=prev_sheet_date.row_idx), # noqa
-        )
-        date_cell = Cell(
-            value=target.strftime('%d.%m.%Y'),
-            col_idx=from_cell.col_idx,
-            row_idx=from_cell.row_idx,
-            bold=True
-        )
-        self._google.merge_cells(from_cell, to_cell, sheet_id=self.gid)
-        nes_columns = (
-            date_cell,
-            Cell(value='Отгрузка', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-            Cell(value='Приход', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-            Cell(value='Реализация', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-            Cell(value='Реализация сумма', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-            Cell(value='Гл. Дом', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-            Cell(value='Кинологи', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-            Cell(value='Благотворительность', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-            Cell(value='Утилизация', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-            Cell(value='Остаток', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-        )
-        self._google.update_cells(nes_columns, sheet_id=self.gid)
-        sheet_date = SheetDate(
-            date=target,
-            col_idx=from_cell.col_idx,
-            row_idx=0,
-            wide=9,
-            cols=[
-                UnderDateColumn(name='Отгрузка', col_idx=from_cell.col_idx, row_idx=from_cell.row_idx + 1),
-                UnderDateColumn(name='Приход', col_idx=from_cell.col_idx + 1, row_idx=from_cell.row_idx + 1),
-                UnderDateColumn(name='Реализация', col_idx=from_cell.col_idx + 2, row_idx=from_cell.row_idx + 1),
-                UnderDateColumn(name='Реализация сумма', col_idx=from_cell.col_idx + 3, row_idx=from_cell.row_idx + 1),
-                UnderDateColumn(name='Гл. Дом', col_idx=from_cell.col_idx + 4, row_idx=from_cell.row_idx + 1),
-                UnderDateColumn(name='Кинологи', col_idx=from_cell.col_idx + 5, row_idx=from_cell.row_idx + 1),
-                UnderDateColumn(name='Благотворительность', col_idx=from_cell.col_idx + 6, row_idx=from_cell.row_idx + 1),
-                UnderDateColumn(name='Утилизация', col_idx=from_cell.col_idx + 7, row_idx=from_cell.row_idx + 1),
-                UnderDateColumn(name='Остаток', col_idx=from_cell.col_idx + 8, row_idx=from_cell.row_idx + 1),
-            ]
-        )
+        # month of opening balances of a partition has no summary block
+        month = self.month_block(prev_sheet_date.date.month, prev_sheet_date.date.year)
+        same_month = (prev_sheet_date.date.year, prev_sheet_date.date.month) == (target.year, target.month)
+        add = 0 if same_month or month is None else month.wide
+        sheet_date = self._new_sheet_date(target, prev_sheet_date.col_idx + prev_sheet_date.wide + add)
+        requests = [
+            insert_dimension_request(self.gid, 'COLUMNS', sheet_date.col_idx, sheet_date.col_idx + sheet_date.wide),
+            *self._header_requests(sheet_date, self.gid),
+            {'createDeveloperMetadata': {'developerMetadata': self._block_metadata(sheet_date)}},
+        ]
+        self._layout_changed = True
+        response = self._google.batch_update(requests)
+        sheet_date.meta_id = response['replies'][-1]['createDeveloperMetadata']['developerMetadata']['metadataId']
+        self._shift_blocks(sheet_date.col_idx, sheet_date.wide)
         self.dates.insert(high, sheet_date)
-        for i in range(high + 1, len(self.dates)):
-            self.dates[i].add_col_idx(9)
-        for sm in self.months:
-            if target.month <= sm.month:
-                sm.add_col_idx(9)
         return high
 
     def _find_cols_indexes(self, *col_names: str, target: datetime.date | SheetDate) -> tuple[ColIdx | None, ...]:
@@ -256,16 +700,7 @@ class AccountingSpreadsheet:
                 raise ValueError('No such date')
             target = self.dates[index]
 
-        if target.cols is None:
-            from_cell = Cell(col_idx=target.col_idx, row_idx=target.row_idx + 1)
-            to_cell = Cell(col_idx=target.col_idx + target.wide - 1, row_idx=target.row_idx + 1)
-            cells_gen = self._google.get_values(sheet_id=self.gid, from_=from_cell, to=to_cell)
-            cols = {c.formatted_value or c.value: c.col_idx for c in cells_gen}
-            cols_under_date: list[UnderDateColumn] = []
-            for col_name, col_idx in cols.items():
-                under_date_col = UnderDateColumn(col_idx, 1, col_name)
-                cols_under_date.append(under_date_col)
-            target.cols = cols_under_date
+        self._load_headers([target])
 
         col_indexes = list(target.find_col_idx(col_name) for col_name in col_names)
         return tuple(col_indexes)
@@ -278,36 +713,30 @@ class AccountingSpreadsheet:
         col_idx = self._find_cols_indexes(col_name, target=sheet_date)[0]
         if col_idx is not None:
             return col_idx
-        _, row_count = self._google.get_size_of_sheet(self.gid)
-        self._google.append_dimension('COLUMNS', self.gid, 1)
-        range_cells = (
-            Cell(col_idx=sheet_date.col_idx + sheet_date.wide, row_idx=0),  # from cell
-            Cell(col_idx=sheet_date.col_idx + sheet_date.wide, row_idx=row_count),  # to cell
+        if self._layout == 'append':
+            if sheet_date.col_idx + sheet_date.wide != self._right_edge:
+                raise ValueError(f'Column "{col_name}" can not be added to {target} in append layout')
+            self._right_edge += 1
+        self._layout_changed = True
+        self._google.insert_dimension(
+            'COLUMNS', self.gid, sheet_date.col_idx + sheet_date.wide, sheet_date.col_idx + sheet_date.wide + 1
         )
-        self._google.insert_range(range_cells[0], range_cells[1], 'COLUMNS', self.gid)
         sheet_date.wide += 1
         new_cells = [
             Cell(value=col_name, col_idx=sheet_date.col_idx + sheet_date.wide - 1, row_idx=1)
         ]
         self._google.update_cells(new_cells, self.gid)
-        for i in range(index + 1, len(self.dates)):
-            self.dates[i].add_col_idx(1)
-
-        for sm in self.months:
-            if sm.month == sheet_date.date.month:
-                sm.add_col_idx(1)
-        sheet_date.cols.append(
-            UnderDateColumn(name=col_name, col_idx=sheet_date.cols[-1].col_idx + 1, row_idx=1)
-        )
+        self._shift_blocks(sheet_date.col_idx + sheet_date.wide - 1, 1)
+        sheet_date.offsets.setdefault(col_name, sheet_date.wide - 1)
+        self._retag(sheet_date)
         return sheet_date.col_idx + sheet_date.wide - 1
 
-    def update_date(self, target: datetime.date | SheetDate) -> None:
-        if isinstance(target, SheetDate):
-            target = target.date
-
-        index = self._binary_dates_srch(target)
-        if index is None:
-            raise ValueError(f'No such date in spreadsheet {target}')
+    def _remainder_cols(self, index: int) -> tuple[tuple[ColIdx | None, ...], ColIdx | None]:
+        """
+        Returns columns of remainder formula of self.dates[index]:
+        (income, sale, main_dom, kino, blago, util, prev_rem, prev_invent) and remainder column itself
+        """
+        sheet_date = self.dates[index]
         (
             income_col_idx,
             sale_col_idx,
@@ -324,40 +753,236 @@ class AccountingSpreadsheet:
             'Благотворительность',
             'Утилизация',
             'Остаток',
-            target=target
+            target=sheet_date
         )
-        (
-            prev_rem_col_idx,
-            prev_invent_col_idx
-        ) = self._find_cols_indexes( # noqa
-            'Остаток',
-            'Инвентаризация',
-            target=self.dates[index-1]
-        ) # noqa
+        prev_rem_col_idx, prev_invent_col_idx = None, None
+        if index > 0:
+            (
+                prev_rem_col_idx,
+                prev_invent_col_idx,
+                prev_checkpoint_col_idx,
+            ) = self._find_cols_indexes( # noqa
+                'Остаток',
+                'Инвентаризация',
+                CHECKPOINT_COL,
+                target=self.dates[index-1]
+            ) # noqa
+            if prev_checkpoint_col_idx is not None:  # chain is cut by checkpoint
+                prev_rem_col_idx, prev_invent_col_idx = prev_checkpoint_col_idx, None
+        cols = (
+            income_col_idx, sale_col_idx, main_dom_idx, kino_idx, blago_idx, util_idx,
+            prev_rem_col_idx, prev_invent_col_idx,
+        )
+        return cols, rem_col_idx
+
+    def _remainder_signature(self, index: int, cols: tuple[ColIdx | None, ...], rem_col_idx: ColIdx | None) -> tuple:
+        """
+        Shift invariant signature of remainder formula of self.dates[index]:
+        equal while the date and its predecessor move together.
+        Checkpoint column is appended right after the remainder, so whether it is used is kept explicitly
+        """
+        sheet_date = self.dates[index]
+        by_checkpoint = index > 0 and self._find_cols_indexes(CHECKPOINT_COL, target=self.dates[index - 1])[0] is not None
+        return (*(None if c is None else c - sheet_date.col_idx for c in (*cols, rem_col_idx)), by_checkpoint)
+
+    @staticmethod
+    def _remainder_formula(row_idx: RowIdx, cols: tuple[ColIdx | None, ...]) -> str:
+        income_col_idx, *minus_cols, prev_rem_col_idx, prev_invent_col_idx = cols
+        val = '='
+        if income_col_idx is not None:
+            c = Cell(col_idx=income_col_idx, row_idx=row_idx)
+            val += f'+{c.name}'
+
+        for minus_col_idx in minus_cols:
+            c = Cell(col_idx=minus_col_idx, row_idx=row_idx)
+            val += f'-{c.name}'
+
+        if prev_rem_col_idx is not None or prev_invent_col_idx is not None:
+            if prev_invent_col_idx is not None and prev_rem_col_idx is not None:
+                invent_cell = Cell(col_idx=prev_invent_col_idx, row_idx=row_idx)
+                rem_cell = Cell(col_idx=prev_rem_col_idx, row_idx=row_idx)
+                val += f'+ЕСЛИ(ЕПУСТО({invent_cell.name}); {rem_cell.name}; {invent_cell.name})'
+            else:
+                cell = Cell(col_idx=prev_invent_col_idx, row_idx=row_idx) if prev_rem_col_idx is None else Cell(col_idx=prev_rem_col_idx, row_idx=row_idx) # noqa
+                val += f'+{cell.name}'
+        return val
 
-        new_cells: list[Cell] = []
-        minus_cols = (sale_col_idx, main_dom_idx, kino_idx, blago_idx, util_idx)
+    def update_date(self, target: datetime.date | SheetDate, fresh: bool = False, flush: bool = True) -> None:
+        """
+        Maintains remainder formulas of the date.
+        Nothing is written if columns of the date and of its predecessor did not move relative
+        to each other since last time, otherwise only rows whose formula differs from the sheet are queued.
+        fresh - the date block was just created and has no formulas.
+        flush - write queued formulas now, else they wait for flush_pending()
+        """
+        if isinstance(target, SheetDate):
+            target = target.date
+
+        index = self._binary_dates_srch(target)
+        if index is None:
+            raise ValueError(f'No such date in spreadsheet {target}')
+        sheet_date = self.dates[index]
+        cols, rem_col_idx = self._remainder_cols(index)
+        signature = self._remainder_signature(index, cols, rem_col_idx)
+        key = sheet_date.block_key()
+
+        formulas = {p.row_idx: self._remainder_formula(p.row_idx, cols) for p in self.products}
+        if self._remainder_signatures.get(key) == signature:
+            written = self._remainder_rows[key]
+            rows = [row_idx for row_idx in formulas if row_idx not in written]
+        else:
+            existing = {} if fresh else self._read_remainders(rem_col_idx)
+            rows = [row_idx for row_idx, formula in formulas.items() if existing.get(row_idx) != formula]
+        for row_idx in rows:
+            self._pending_cells[(rem_col_idx, row_idx)] = Cell(
+                value=formulas[row_idx], col_idx=rem_col_idx, row_idx=row_idx
+            )
+        self._pending_signatures[key] = (signature, set(formulas))
+        if flush:
+            self.flush_pending()
+
+    def _read_remainders(self, rem_col_idx: ColIdx) -> dict[RowIdx, Any]:
+        if not self.products:
+            return {}
+        from_cell = Cell(col_idx=rem_col_idx, row_idx=min(p.row_idx for p in self.products))
+        to_cell = Cell(col_idx=rem_col_idx, row_idx=max(p.row_idx for p in self.products))
+        with tracer.span('read old values'):
+            return {c.row_idx: c.value for c in self._google.get_values(sheet_id=self.gid, from_=from_cell, to=to_cell)}
+
+    def closing_balances(self, target: datetime.date) -> dict[RowIdx, int | float]:
+        """
+        Remainders the next date starts from: inventory if it is set, else remainder,
+        as evaluated by the spreadsheet. Unformatted values are read, so number format does not round them.
+        Empty if the date has no remainder column
+        """
+        index = self._binary_dates_srch(target)
+        if index is None:
+            raise ValueError(f'No such date in spreadsheet {target}')
+        rem_col_idx, invent_col_idx = self._find_cols_indexes('Остаток', 'Инвентаризация', target=self.dates[index])
+        if rem_col_idx is None or not self.products:
+            return {}
+        read_cols = [c for c in (rem_col_idx, invent_col_idx) if c is not None]
+        from_cell = Cell(col_idx=min(read_cols), row_idx=min(p.row_idx for p in self.products))
+        to_cell = Cell(col_idx=max(read_cols), row_idx=max(p.row_idx for p in self.products))
+        with tracer.span('read old values'):
+            values = self._read_evaluated([(from_cell, to_cell)])
+        balances: dict[RowIdx, int | float] = {}
         for p in self.products:
-            val = '='
-            if income_col_idx is not None:
-                c = Cell(col_idx=income_col_idx, row_idx=p.row_idx)
-                val += f'+{c.name}'
-
-            for minus_col_idx in minus_cols:
-                c = Cell(col_idx=minus_col_idx, row_idx=p.row_idx)
-                val += f'-{c.name}'
-
-            if prev_rem_col_idx is not None or prev_invent_col_idx is not None:
-                if prev_invent_col_idx is not None and prev_rem_col_idx is not None:
-                    invent_cell = Cell(col_idx=prev_invent_col_idx, row_idx=p.row_idx)
-                    rem_cell = Cell(col_idx=prev_rem_col_idx, row_idx=p.row_idx)
-                    val += f'+ЕСЛИ(ЕПУСТО({invent_cell.name}); {rem_cell.name}; {invent_cell.name})'
+            value = values.get((invent_col_idx, p.row_idx)) if invent_col_idx is not None else None
+            if value is None or value == '':
+                value = values.get((rem_col_idx, p.row_idx))
+            balances[p.row_idx] = parse_number(value)
+        return balances
+
+    def _read_evaluated(self, ranges: list[tuple[Cell, Cell]]) -> dict[tuple[ColIdx, RowIdx], Any]:
+        """
+        Unformatted values of the ranges as evaluated by the spreadsheet, in one request
+        """
+        return {
+            (c.col_idx, c.row_idx): c.value
+            for c in self._google.get_values_batch(ranges, sheet_id=self.gid, include_grid_data=False)
+        }
+
+    def set_opening_balances(self, balances: dict[RowIdx, int | float]) -> None:
+        """
+        Partition: writes remainders carried over from the previous partition into the first date block
+        """
+        if not balances or not self.dates:
+            return
+        rem_col_idx = self._find_cols_indexes('Остаток', target=self.dates[0])[0]
+        new_cells = [Cell(value=value, col_idx=rem_col_idx, row_idx=row_idx) for row_idx, value in balances.items()]
+        with tracer.span('write'):
+            self._google.update_cells(new_cells, self.gid)
+        self._refresh_checkpoints(self.dates[0].date)
+
+    def checkpoint(self, target: datetime.date) -> None:
+        """
+        Freezes remainders of the date which the next date starts from
+        (inventory if it is set, else remainder) as plain values in CHECKPOINT_COL.
+        The next date refers to that column, so the formula chain does not go further back
+        """
+        index = self._binary_dates_srch(target)
+        if index is None:
+            raise ValueError(f'No such date in spreadsheet {target}')
+        balances = self.closing_balances(target)
+        if not balances:
+            return
+        checkpoint_col_idx = self._find_cols_indexes(CHECKPOINT_COL, target=self.dates[index])[0]
+        if checkpoint_col_idx is None:
+            checkpoint_col_idx = self.append_col(target, CHECKPOINT_COL)
+        new_cells = [
+            Cell(value=value, col_idx=checkpoint_col_idx, row_idx=row_idx) for row_idx, value in balances.items()
+        ]
+        with tracer.span('write'):
+            self._google.update_cells(new_cells, self.gid)
+        if index + 1 < len(self.dates):
+            self.update_date(self.dates[index + 1])
+
+    def _refresh_checkpoints(self, since: datetime.date) -> None:
+        """
+        Recomputes checkpoints which depend on values changed at the since date, in one pass in date order.
+        Evaluated remainders, inventories and checkpoints of the dates up to the last checkpoint are read
+        in one request. Remainders after a checkpoint are evaluated from its old value, so the change
+        of each checkpoint is carried forward to the next one. Changed checkpoints are written in one request
+        """
+        start = next((i for i, sd in enumerate(self.dates) if sd.date >= since), len(self.dates))
+        cols = {
+            i: self._find_cols_indexes('Остаток', 'Инвентаризация', CHECKPOINT_COL, target=self.dates[i])
+            for i in range(start, len(self.dates))
+        }
+        checkpointed = [i for i, (_, _, checkpoint_col_idx) in cols.items() if checkpoint_col_idx is not None]
+        if not checkpointed or not self.products:
+            return
+        last = checkpointed[-1]
+        min_row_idx = min(p.row_idx for p in self.products)
+        max_row_idx = max(p.row_idx for p in self.products)
+        ranges = []
+        for i in range(start, last + 1):
+            read_cols = [c for c in cols[i] if c is not None]
+            if read_cols:
+                ranges.append((Cell(col_idx=min(read_cols), row_idx=min_row_idx),
+                               Cell(col_idx=max(read_cols), row_idx=max_row_idx)))
+        with tracer.span('read old values'):
+            values = self._read_evaluated(ranges)
+
+        # change of the closing balance of the previous date which the spreadsheet has not seen yet
+        deltas: dict[RowIdx, int | float] = {p.row_idx: 0 for p in self.products}
+        new_cells = []
+        for i in range(start, last + 1):
+            rem_col_idx, invent_col_idx, checkpoint_col_idx = cols[i]
+            for p in self.products:
+                if rem_col_idx is None:
+                    deltas[p.row_idx] = 0
+                    continue
+                inventory = values.get((invent_col_idx, p.row_idx)) if invent_col_idx is not None else None
+                if inventory is None or inventory == '':
+                    evaluated = parse_number(values.get((rem_col_idx, p.row_idx)))
+                    closing = evaluated + deltas[p.row_idx]
                 else:
-                    cell = Cell(col_idx=prev_invent_col_idx, row_idx=p.row_idx) if prev_rem_col_idx is None else Cell(col_idx=prev_rem_col_idx, row_idx=p.row_idx) # noqa
-                    val += f'+{cell.name}'
-            c = Cell(value=val, col_idx=rem_col_idx, row_idx=p.row_idx)
-            new_cells.append(c)
-        self._google.update_cells(new_cells, self.gid)
+                    evaluated = closing = parse_number(inventory)
+                if checkpoint_col_idx is None:
+                    deltas[p.row_idx] = closing - evaluated
+                    continue
+                stored = values.get((checkpoint_col_idx, p.row_idx))
+                if stored is None or stored == '' or parse_number(stored) != closing:
+                    new_cells.append(Cell(value=closing, col_idx=checkpoint_col_idx, row_idx=p.row_idx))
+                deltas[p.row_idx] = closing - parse_number(stored)
+        if new_cells:
+            with tracer.span('write'):
+                self._google.update_cells(new_cells, self.gid)
+
+    def flush_pending(self) -> None:
+        """
+        Writes all queued remainder formulas in one request
+        """
+        if self._pending_cells:
+            with tracer.span('write'):
+                self._google.update_cells(list(self._pending_cells.values()), self.gid)
+        for key, (signature, rows) in self._pending_signatures.items():
+            self._remainder_signatures[key] = signature
+            self._remainder_rows[key] = rows
+        self._pending_cells = {}
+        self._pending_signatures = {}
 
     @property
     def products(self) -> list[SheetProduct]:
@@ -389,90 +1014,132 @@ class AccountingSpreadsheet:
                         data['name'] = c.formatted_value or c.value
                     case 2:  # price column
                         price = c.formatted_value or c.value
-                        data['price'] = int(price) if price is not None else 0
+                        data['price'] = parse_number(price)
             else:
                 products.append(SheetProduct(**data, row_idx=row_idx))
 
             self._products = products
+            self._plu_index = {p.plu: p.row_idx for p in products}
         return self._products
 
     def _find_dates_with_months(self) -> tuple[list[SheetDate], list[SheetMonth]]:
         """
-        Gets lists of SheetDate's and SheetMonth's
+        Gets lists of SheetDate's and SheetMonth's with their columns from one read of both header rows.
+        A block spans up to the next title, the last one up to the first empty sub-header
         """
-        dates_cells_gen = self._google.get_values(sheet_id=self.gid, from_='E1', to='ZZZ1')
+        titles: dict[ColIdx, Any] = {}
+        headers: dict[ColIdx, Any] = {}
+        for c in self._google.get_values(sheet_id=self.gid, from_='E1', to='ZZZ2'):
+            value = c.formatted_value or c.value
+            if value is None or value == '':
+                continue
+            if c.row_idx == 0:
+                titles[c.col_idx] = value
+            elif c.row_idx == 1:
+                headers[c.col_idx] = value
+
         dates: list[SheetDate] = []
         months: list[SheetMonth] = []
-        wide = 1
-        flag = False
-        last_encountered_type: Literal['date', 'month'] = 'date'
-        for c in list(dates_cells_gen):
-            if c.value is None and c.formatted_value is None:
-                if flag:
-                    wide += 1
-                continue
-            cell_date = c.formatted_value or c.value
+        title_cols = sorted(titles)
+        for i, col_idx in enumerate(title_cols):
+            title = titles[col_idx]
             try:
-                date = datetime.datetime.strptime(cell_date, '%d.%m.%Y').date()
-                sheet_date = SheetDate(date, c.col_idx, c.row_idx)
-                if last_encountered_type == 'date' and len(dates) > 0:  # set previous date wide
-                    dates[-1].wide = wide
-                elif last_encountered_type == 'month' and len(dates) > 0:  # set last month wide
-                    months[-1].wide = wide
-                dates.append(sheet_date)
-                flag = True
-                wide = 1
-                last_encountered_type = 'date'
-            except ValueError:
-                if cell_date in SEASONS:
-                    sheet_month = SheetMonth(cell_date, c.col_idx, c.row_idx)
-                    if last_encountered_type == 'date' and len(dates) > 0:  # set previous date wide
-                        dates[-1].wide = wide
-                    elif last_encountered_type == 'month' and len(dates) > 0:  # set last month wide
-                        months[-1].wide = wide
-                    months.append(sheet_month)
-                    flag = True
-                    wide = 1
-                    last_encountered_type = 'month'
-                else:
-                    flag = False  # switch flag to false to forbid increasing wide
-
-        # calculating last elem wide
-        collection = dates if last_encountered_type == 'date' else months
-        from_cell = Cell(col_idx=collection[-1].col_idx, row_idx=1)
-        to_cell = Cell(col_idx=collection[-1].col_idx + wide, row_idx=1)
-        cols_gen = self._google.get_values(sheet_id=self.gid, from_=from_cell, to=to_cell)
-        wide = 1
-        for c in cols_gen:
-            if c.col_idx == collection[-1].col_idx:
-                continue
-            val = c.formatted_value or c.value
-            if val is None:
-                break
-            wide += 1
-        collection[-1].wide = wide
+                block = SheetDate(datetime.datetime.strptime(title, '%d.%m.%Y').date(), col_idx, 0)
+                dates.append(block)
+            except (TypeError, ValueError):
+                if title not in SEASONS:
+                    continue  # other titles only end the previous block
+                # summary block follows the dates it sums
+                block = SheetMonth(title, col_idx, 0, year=dates[-1].date.year if dates else None)
+                months.append(block)
+            if i + 1 < len(title_cols):
+                end_col_idx = title_cols[i + 1]
+            else:
+                end_col_idx = col_idx + 1
+                while end_col_idx in headers:
+                    end_col_idx += 1
+            block.wide = end_col_idx - col_idx
+            block.offsets = col_offsets(headers.get(c) for c in range(col_idx, end_col_idx))
         return dates, months
 
+    def _load_headers(self, blocks: list[SheetDate | SheetMonth]) -> None:
+        """
+        Fills offsets of the blocks which have none from one read of the sub-header row over their span
+        """
+        blocks = [b for b in blocks if b.offsets is None]
+        if not blocks:
+            return
+        from_cell = Cell(col_idx=min(b.col_idx for b in blocks), row_idx=1)
+        to_cell = Cell(col_idx=max(b.col_idx + b.wide for b in blocks) - 1, row_idx=1)
+        headers: dict[ColIdx, Any] = {}
+        for c in self._google.get_values(sheet_id=self.gid, from_=from_cell, to=to_cell):
+            value = c.formatted_value or c.value
+            if value is not None and value != '':
+                headers[c.col_idx] = value
+        for b in blocks:
+            b.offsets = col_offsets(headers.get(c) for c in range(b.col_idx, b.col_idx + b.wide))
+
+    def _find_summary_months(self) -> list[SheetMonth]:
+        """
+        Append layout: gets month blocks of the summary sheet, they are written by us with fixed columns
+        """
+        months: list[SheetMonth] = []
+        for c in self._google.get_values(sheet_id=self.summary_gid, from_='E1', to='ZZZ1'):
+            name = c.formatted_value or c.value
+            if name in SEASONS:
+                months.append(self._new_sheet_month(SEASONS.index(name) + 1, c.col_idx))
+        return months
+
+    def _discover_layout(self) -> None:
+        with tracer.span('layout discovery'):
+            dates, months = self._find_dates_with_months()
+            if self._layout == 'append':
+                # month blocks left on the dates sheet are not maintained, new blocks go after them
+                self._right_edge = max((b.col_idx + b.wide for b in (*dates, *months)), default=4)
+                dates.sort(key=lambda sd: sd.date)
+                months = self._find_summary_months()
+                # the summary sheet has one block per month name, it sums the latest dates of the month
+                for sm in months:
+                    sm.year = max((sd.date.year for sd in dates if sd.date.month == sm.month), default=None)
+        months.sort(key=_month_order)
+        self._dates = dates
+        self._months = months
+        self._month_blocks = {(sm.year, sm.month): sm for sm in months}
+
     @property
     def months(self) -> list[SheetMonth]:
         """
         Gets list of SheetMonth's
         """
         if self._months is None:
-            dates, months = self._find_dates_with_months()
-            self._dates = dates
-            self._months = months
+            self._discover_layout()
         return self._months
 
+    def month_block(self, month: int, year: int | None = None) -> SheetMonth | None:
+        """
+        Gets summary block of the month of the year if it exists, a block without year matches any year.
+        Without year the block of the latest year is returned
+        """
+        if self._months is None:
+            self._discover_layout()
+        if year is None:
+            return next((sm for sm in reversed(self._months) if sm.month == month), None)
+        return self._month_blocks.get((year, month)) or self._month_blocks.get((None, month))
+
+    def _add_month(self, sheet_month: SheetMonth) -> None:
+        """
+        Caches new summary block keeping self.months ordered by year and month
+        """
+        self.months.insert(bisect.bisect(self.months, _month_order(sheet_month), key=_month_order), sheet_month)
+        self._month_blocks[(sheet_month.year, sheet_month.month)] = sheet_month
+
     @property
     def dates(self) -> list[SheetDate]:
         """
         Gets list of SheetDate's
         """
         if self._dates is None:
-            dates, months = self._find_dates_with_months()
-            self._dates = dates
-            self._months = months
+            self._discover_layout()
         return self._dates
 
     def create_date(self, date: datetime.date | None = None) -> SheetDate:
@@ -481,440 +1148,802 @@ class AccountingSpreadsheet:
         """
         if date is None:
             date = datetime.datetime.now().date()
-        index = self._binary_dates_srch(date)
-        if index is None:  # check there is no already created date
-            index = self._insert_date(date)
-            self.update_date(date)
-            try:
-                self.update_month(date.month)
-            except ValueError:
-                self.summarize_month(date.month)
-            try:
-                self.update_date(self.dates[index+1].date)
-            except IndexError:
-                pass
+        if self.period_start is not None and date < self.period_start:
+            raise ValueError(f'Date {date} is before the period of the sheet starting {self.period_start}')
+        if self._check_drift and self.is_loaded:
+            with tracer.span('drift check'):
+                self.detect_drift(date)
+        self._ensure_post_init()
+        with tracer.span('create_date', date=date):
+            index = self._binary_dates_srch(date)
+            if index is None:  # check there is no already created date
+                if 'month' in self._checkpoint_on:
+                    prev_dates = [sd for sd in self.dates if sd.date < date]
+                    if prev_dates and prev_dates[-1].date.month != date.month:
+                        self.checkpoint(prev_dates[-1].date)
+                index = self._insert_date(date)
+                self.update_date(date, fresh=True, flush=False)
+                try:
+                    self.update_date(self.dates[index+1].date, flush=False)
+                except IndexError:
+                    pass
+                self.flush_pending()
+                try:
+                    self.update_month(date.month, date.year)
+                except ValueError:
+                    self.summarize_month(date.month, year=date.year)
         return self.dates[index]
 
-    def create_shipment(self, shipments: list[Shipment], date: datetime.date | None = None):
+    def _shift_blocks(self, from_col_idx: ColIdx, num: int) -> None:
         """
-        Cerate new shipments and update google spreadsheet
+        Moves cached blocks of the dates sheet starting at from_col_idx or further right by num columns
         """
-        sheet_date = self.create_date(date)
-        shipment_col_idx = self._find_cols_indexes('Отгрузка', target=sheet_date)[0]
-        plus = {s.plu: {'shipment': s, 'row_idx': -1} for s in shipments}
-        for p in self.products:
-            if p.plu in plus:
-                plus[p.plu]['row_idx'] = p.row_idx
-
-        from_cell = Cell(col_idx=shipment_col_idx, row_idx=min(v['row_idx'] for v in plus.values() if v['row_idx'] != -1))
-        to_cell = Cell(col_idx=shipment_col_idx, row_idx=max(v['row_idx'] for v in plus.values() if v['row_idx'] != -1))
-
-        old_shipments_gen = self._google.get_values(sheet_id=self.gid, from_=from_cell, to=to_cell)
-        old_shipments = {c.row_idx: c for c in old_shipments_gen}
+        blocks = self.dates if self._layout == 'append' else (*self.dates, *self.months)
+        for block in blocks:
+            if block.col_idx >= from_col_idx:
+                block.add_col_idx(num)
 
-        new_shipments: list[Cell] = []
-        for data in plus.values():
-            shipment: Shipment = data['shipment']
-            row_idx: RowIdx = data['row_idx']
-            try:
-                old_shipment: Cell = old_shipments[row_idx]
-                old_value = old_shipment.formatted_value or old_shipment.value
-            except KeyError:
-                old_value = 0
-
-            if old_value is None:
-                old_value = 0
-            if isinstance(old_value, str):
-                if old_value.isdigit():
-                    old_value = int(old_value)
+    def preallocate_dates(self, start: datetime.date, end: datetime.date) -> list[SheetDate]:
+        """
+        Creates blocks of missing dates from start to end (inclusive) that go after the last date.
+        Columns, headers, month blocks, metadata tags and remainder formulas are sent in one batchUpdate,
+        then month summaries are updated once per month
+        """
+        self._ensure_post_init()
+        if not self.dates:
+            raise ValueError('Spreadsheet has no dates to continue from')
+        targets: list[datetime.date] = []
+        day = max(start, self.dates[-1].date + datetime.timedelta(days=1))
+        while day <= end:
+            targets.append(day)
+            day += datetime.timedelta(days=1)
+        if not targets:
+            return []
+
+        prev_last_date = self.dates[-1]
+        structure: list[dict] = []
+        new_blocks: list[SheetDate | SheetMonth] = []
+        try:
+            for target in targets:
+                prev = self.dates[-1]
+                prev_month = self.month_block(prev.date.month, prev.date.year)
+                if self._layout == 'append':
+                    start_col_idx = self._right_edge
+                elif (target.year, target.month) == (prev.date.year, prev.date.month) or prev_month is None:
+                    start_col_idx = prev.col_idx + prev.wide
                 else:
-                    old_value = float(old_value)
-            new_value = shipment.weight + old_value
-            if isinstance(new_value, float):
-                new_value = round(new_value, 3)
-            new_cell = Cell(value=new_value, col_idx=shipment_col_idx, row_idx=row_idx)
-            new_shipments.append(new_cell)
-        self._google.update_cells(new_shipments, self.gid)
+                    start_col_idx = prev_month.col_idx + prev_month.wide
+                sheet_date = self._new_sheet_date(target, start_col_idx)
+                structure.append(insert_dimension_request(self.gid, 'COLUMNS', start_col_idx, start_col_idx + sheet_date.wide))
+                if self._layout == 'append':
+                    self._right_edge += sheet_date.wide
+                else:
+                    self._shift_blocks(start_col_idx, sheet_date.wide)
+                self.dates.append(sheet_date)
+                new_blocks.append(sheet_date)
+
+                # month blocks of append layout are created on the summary sheet afterwards
+                if self._layout == 'insert' and self.month_block(target.month, target.year) is None:
+                    month_col_idx = start_col_idx + sheet_date.wide
+                    structure.append(insert_dimension_request(self.gid, 'COLUMNS', month_col_idx, month_col_idx + len(MONTH_COLS)))
+                    self._shift_blocks(month_col_idx, len(MONTH_COLS))
+                    sheet_month = self._new_sheet_month(target.month, month_col_idx, target.year)
+                    self._add_month(sheet_month)
+                    self._month_refs[sheet_month.block_key()] = {}
+                    new_blocks.append(sheet_month)
+
+            # cells are written in final coordinates, after all columns are inserted
+            headers: list[dict] = []
+            for block in new_blocks:
+                headers.extend(self._header_requests(block, self.gid))
+            cells: list[Cell] = []
+            remainders: dict[str, tuple[tuple, set[RowIdx]]] = {}
+            for sheet_date in new_blocks:
+                if not isinstance(sheet_date, SheetDate):
+                    continue
+                index = self._binary_dates_srch(sheet_date.date)
+                cols, rem_col_idx = self._remainder_cols(index)
+                for p in self.products:
+                    cells.append(Cell(value=self._remainder_formula(p.row_idx, cols), col_idx=rem_col_idx, row_idx=p.row_idx))
+                signature = self._remainder_signature(index, cols, rem_col_idx)
+                remainders[sheet_date.block_key()] = (signature, {p.row_idx for p in self.products})
+
+            metadata = [{'createDeveloperMetadata': {'developerMetadata': self._block_metadata(b)}} for b in new_blocks]
+            requests = [*structure, *headers, *update_cells_requests(cells, self.gid), *metadata]
+            self._layout_changed = True
+            with tracer.span('preallocate', dates=len(targets)):
+                response = self._google.batch_update(requests)
+        except Exception:
+            self.invalidate()  # cached layout may not match the sheet anymore
+            raise
+
+        replies = response.get('replies', [])[-len(metadata):]
+        for block, reply in zip(new_blocks, replies):
+            block.meta_id = reply['createDeveloperMetadata']['developerMetadata']['metadataId']
+        for key, (signature, rows) in remainders.items():
+            self._remainder_signatures[key] = signature
+            self._remainder_rows[key] = rows
+
+        for year, month in sorted({(d.year, d.month) for d in (prev_last_date.date, *targets)}):
+            if self.month_block(month, year) is not None:
+                self.update_month(month, year)
+            elif self._layout == 'append':
+                self.summarize_month(month, year=year)
+        if 'month' in self._checkpoint_on:
+            for prev, sheet_date in zip(self.dates, self.dates[1:]):
+                if sheet_date in new_blocks and prev.date.month != sheet_date.date.month:
+                    self.checkpoint(prev.date)
+        return [b for b in new_blocks if isinstance(b, SheetDate)]
 
-    def create_income(self, incomes: list[Income], date: datetime.date | None = None):
+    @property
+    def plu_index(self) -> dict[int, RowIdx]:
         """
-        Create new income and update google spreadsheet
+        Row of every PLU, built once with the product list
         """
-        sheet_date = self.create_date(date)
-        income_col_idx = self._find_cols_indexes('Приход', target=sheet_date)[0]
-        plus = {i.plu: {'income': i, 'row_idx': -1} for i in incomes}
-        for p in self.products:
-            if p.plu in plus:
-                plus[p.plu]['row_idx'] = p.row_idx
-
-        from_cell = Cell(col_idx=income_col_idx, row_idx=min(v['row_idx'] for v in plus.values() if v['row_idx'] != -1))
-        to_cell = Cell(col_idx=income_col_idx, row_idx=max(v['row_idx'] for v in plus.values() if v['row_idx'] != -1))
-
-        old_incomes_gen = self._google.get_values(sheet_id=self.gid, from_=from_cell, to=to_cell)
-        old_incomes = {c.row_idx: c for c in old_incomes_gen}
+        if self._plu_index is None:
+            self.products
+        return self._plu_index
 
-        new_incomes: list[Cell] = []
-        for data in plus.values():
-            income: Income = data['income']
-            row_idx: RowIdx = data['row_idx']
-            try:
-                old_income: Cell = old_incomes[row_idx]
-                old_value = old_income.formatted_value or old_income.value
-            except KeyError:
-                old_value = 0
-
-            if old_value is None:
-                old_value = 0
-            if isinstance(old_value, str):
-                if old_value.isdigit():
-                    old_value = int(old_value)
-                else:
-                    if ',' in old_value:
-                        old_value = old_value.replace(',', '.')
-                    old_value = float(old_value)
-            new_value = income.weight + old_value
-            if isinstance(new_value, float):
-                new_value = round(new_value, 3)
-            new_cell = Cell(value=new_value, col_idx=income_col_idx, row_idx=row_idx)
-            new_incomes.append(new_cell)
-        self._google.update_cells(new_incomes, self.gid)
+    def provision_products(self, catalog: dict[int, tuple[str, int | float]]) -> list[SheetProduct]:
+        """
+        Adds rows of catalog products, {plu: (name, price)}, which the sheet has not, in one batchUpdate:
+        rows are inserted after the last product and get PLU, name, price, remainder formulas
+        of every date and month summary formulas. Cached products and PLU index are extended in place.
+        Returns added products
+        """
+        index = self.plu_index
+        missing = [plu for plu in catalog if plu not in index]
+        if not missing:
+            return []
+        first_row_idx = max((p.row_idx for p in self.products), default=1) + 1
+        added = [
+            SheetProduct(plu=plu, name=catalog[plu][0], price=catalog[plu][1], row_idx=first_row_idx + i)
+            for i, plu in enumerate(missing)
+        ]
+        rows = [p.row_idx for p in added]
+
+        cells: list[Cell] = []
+        for p in added:
+            cells.extend((
+                Cell(value=p.plu, col_idx=0, row_idx=p.row_idx),
+                Cell(value=p.name, col_idx=1, row_idx=p.row_idx),
+                Cell(value=p.price, col_idx=2, row_idx=p.row_idx),
+            ))
+        self._load_headers(self.dates)
+        for i, sheet_date in enumerate(self.dates):
+            cols, rem_col_idx = self._remainder_cols(i)
+            if rem_col_idx is not None:
+                cells.extend(
+                    Cell(value=self._remainder_formula(row_idx, cols), col_idx=rem_col_idx, row_idx=row_idx)
+                    for row_idx in rows
+                )
+
+        month_cells: list[Cell] = []
+        if self._layout == 'append' and self.months:
+            for row_idx in rows:
+                month_cells.extend(
+                    Cell(value=f'={self._date_ref(product_col_idx, row_idx)}', col_idx=product_col_idx, row_idx=row_idx)
+                    for product_col_idx in range(3)
+                )
+        for sheet_month in self.months:
+            if self._summary_mode == 'range':
+                name = self._month_range_name(sheet_month)
+                month_cells.extend(
+                    Cell(value=RANGE_SUMMARY_FORMULA.format(range=name, name=col_name),
+                         col_idx=sheet_month.col_idx + offset, row_idx=row_idx)
+                    for offset, col_name in enumerate(MONTH_COLS) for row_idx in rows
+                )
+                continue
+            cols_by_name, _ = self._month_cols(self._month_dates(sheet_month))
+            month_cells.extend(
+                self._month_cell(sheet_month, name, cols_by_name[name], row_idx)
+                for name in MONTH_COLS for row_idx in rows
+            )
+        month_cells = [c for c in month_cells if c.value is not None]
 
+        end_row_idx = first_row_idx + len(added)
+        requests = [insert_dimension_request(self.gid, 'ROWS', first_row_idx, end_row_idx, inherit_from_before=True)]
+        if self.months_gid != self.gid:
+            requests.append(
+                insert_dimension_request(self.months_gid, 'ROWS', first_row_idx, end_row_idx, inherit_from_before=True)
+            )
+            requests.extend(update_cells_requests(cells, self.gid))
+            if month_cells:
+                requests.extend(update_cells_requests(month_cells, self.months_gid))
+        else:
+            requests.extend(update_cells_requests([*cells, *month_cells], self.gid))
+        with tracer.span('provision products', products=len(added)):
+            self._google.batch_update(requests)
+
+        self._products.extend(added)
+        index.update((p.plu, p.row_idx) for p in added)
+        for written in self._remainder_rows.values():
+            written.update(rows)
+        for _, written in self._pending_signatures.values():
+            written.update(rows)
+        self._layout_changed = True
+        return added
+
+    def rows_of(self, items: Iterable[Shipment | Income | Sale | Inventory]) -> dict[int, RowIdx]:
+        """
+        Rows of PLUs of given items. Raises ValueError naming PLUs which the spreadsheet has not
+        """
+        index = self.plu_index
+        missing = sorted({item.plu for item in items if item.plu not in index})
+        if missing:
+            raise ValueError(f'No such PLU in spreadsheet: {", ".join(map(str, missing))}')
+        return {item.plu: index[item.plu] for item in items}
 
-    def create_sale(self, sales: list[Sale], date: datetime.date | None = None):
+    def _read_ranges(self, ranges: list[tuple[Cell, Cell]]) -> Iterator[Cell]:
         """
-        Create new sale and update google spreadsheet
+        Reads given ranges of the dates sheet in one request, see plan_reads.
+        With the sales log notes are not needed, so only values are read
         """
-        sheet_date = self.create_date(date)
-        (
-            sale_col_idx,
-            sale_sum_col_idx,
-            main_dom_col_idx,
-            kino_col_idx,
-            blago_col_idx,
-            util_col_idx,
-        ) = self._find_cols_indexes(
-            'Реализация',
-            'Реализация сумма',
-            'Гл. Дом',
-            'Кинологи',
-            'Благотворительность',
-            'Утилизация',
-            target=sheet_date
-        )
-        plus = {s.plu: {'sale': s, 'row_idx': -1} for s in sales}
-        for p in self.products:
-            if p.plu in plus:
-                plus[p.plu]['row_idx'] = p.row_idx
+        if not ranges:
+            return iter(())
+        return self._google.get_values_batch(ranges, sheet_id=self.gid, include_grid_data=self.sales_log_gid is None)
 
-        cols = [sale_col_idx, sale_sum_col_idx, main_dom_col_idx, kino_col_idx, blago_col_idx, util_col_idx]
-        from_cell = Cell(
-            col_idx=min(col_idx for col_idx in cols if col_idx is not None),
-            row_idx=min(v['row_idx'] for v in plus.values() if v['row_idx'] != -1)
-        )
-        to_cell = Cell(
-            col_idx=max(col_idx for col_idx in cols if col_idx is not None),
-            row_idx=max(v['row_idx'] for v in plus.values() if v['row_idx'] != -1)
-        )
+    @contextmanager
+    def batch(self, on_written: Callable[[list[list]], None] | None = None) -> Iterator[None]:
+        """
+        Collects writes made inside the block and applies them on exit: missing dates are created,
+        touched cells of all writes are read in one request, increments are merged in memory
+        and written by one batchUpdate, so either all values are applied or none.
+        Nothing is applied if the block raises. Nested blocks join the outer one.
+        on_written is called with item lists of the written operations right after the values are written,
+        before summaries, stock index and checkpoints are updated, so a caller can acknowledge them
+        even if one of those steps fails
+        """
+        if self._batch is not None:
+            yield
+            return
+        operations: list[tuple[str, list, datetime.date]] = []
+        self._batch = operations
+        try:
+            yield
+        finally:
+            self._batch = None
+        self._run(operations, on_written)
+
+    def _submit(self, kind: str, items: list, date: datetime.date | None) -> None:
+        if date is None:
+            date = datetime.datetime.now().date()
+        if self._batch is None:
+            self._run([(kind, items, date)])
+            return
+        self.rows_of(items)  # unknown PLU fails the call, not the whole batch
+        self._batch.append((kind, items, date))
 
-        old_cells_gen = self._google.get_values(sheet_id=self.gid, from_=from_cell, to=to_cell)
-        old_sales: dict[RowIdx, Cell] = {}
-        other_cells: dict[RowIdx, list[Cell]] = {}
-        for c in old_cells_gen:
-            if c.col_idx == sale_col_idx:
-                old_sales[c.row_idx] = c
+    def _run(self, operations: list[tuple[str, list, datetime.date]],
+             on_written: Callable[[list[list]], None] | None = None) -> None:
+        """
+        Applies operations with one read of touched cells and one write of new values
+        """
+        if not operations:
+            return
+        rows = self.rows_of([item for _, items, _ in operations for item in items])
+        planned: list[tuple[str, list, SheetDate]] = []
+        for kind, items, date in operations:
+            sheet_date = self.create_date(date)
+            if kind == 'inventory' and self._find_cols_indexes('Инвентаризация', target=sheet_date)[0] is None:
+                self.append_col(sheet_date.date, 'Инвентаризация')
+                index = self._binary_dates_srch(sheet_date.date)
+                if index + 1 < len(self.dates):
+                    self.update_date(self.dates[index + 1])
+            planned.append((kind, items, sheet_date))
+
+        # blocks are looked up after all dates are created, as creating a date moves the ones after it
+        ranges: dict[tuple[str, str], tuple[Cell, Cell]] = {}
+        for kind, items, sheet_date in planned:
+            cols = self._find_cols_indexes(*OPERATION_COLS[kind], target=sheet_date)
+            for from_cell, to_cell in plan_reads((rows[item.plu] for item in items), cols):
+                ranges[(from_cell.name, to_cell.name)] = (from_cell, to_cell)
+        with tracer.span('read old values'):
+            cells = {(c.col_idx, c.row_idx): c for c in self._read_ranges(list(ranges.values()))}
+
+        written: dict[tuple[ColIdx, RowIdx], Cell] = {}
+        for kind, items, sheet_date in planned:
+            if kind == 'sale':
+                new_cells = self._apply_sales(items, sheet_date, rows, cells)
+            else:
+                col_idx = self._find_cols_indexes(*OPERATION_COLS[kind], target=sheet_date)[0]
+                new_cells = [self._increment(cells, col_idx, rows[item.plu], item.weight) for item in items]
+            for cell in new_cells:
+                cells[(cell.col_idx, cell.row_idx)] = cell
+                written[(cell.col_idx, cell.row_idx)] = cell
+        log_rows = []
+        if self.sales_log_gid is not None:
+            for kind, items, sheet_date in planned:
+                if kind == 'sale':
+                    sales = {sale.plu: sale for sale in items}  # the same sales as _apply_sales writes
+                    log_rows.extend(self._sales_log_row(sale, sheet_date.date) for sale in sales.values())
+        if self.sales_log_gid is not None and written:
+            with tracer.span('write'):
+                self._google.batch_update([
+                    *update_cells_requests(written.values(), self.gid, fields=SALES_LOG_FIELDS),
+                    *([append_cells_request(log_rows, self.sales_log_gid)] if log_rows else []),
+                ])
+        elif written:
+            with tracer.span('write'):
+                self._google.update_cells(list(written.values()), self.gid)
+        if on_written is not None:
+            on_written([items for _, items, _ in operations])
+        for kind, items, sheet_date in planned:
+            for item in items:
+                self.index.add(kind, item.plu, sheet_date.date, item.weight, getattr(item, 'customer', None))
+
+        since = None
+        for kind, items, sheet_date in planned:
+            if kind == 'shipment':
                 continue
-            if c.row_idx not in other_cells:
-                other_cells[c.row_idx] = []
-            other_cells[c.row_idx].append(c)
+            date = sheet_date.date
+            if kind == 'inventory' and 'inventory' in self._checkpoint_on:
+                self.checkpoint(date)
+                date += datetime.timedelta(days=1)
+            since = date if since is None else min(since, date)
+        if since is not None:
+            self._refresh_checkpoints(since)
+
+    @staticmethod
+    def _increment(cells: dict[tuple[ColIdx, RowIdx], Cell], col_idx: ColIdx, row_idx: RowIdx,
+                   weight: int | float, note: str | None = None) -> Cell:
+        """
+        New cell with weight added to the value of the cell in cells
+        """
+        old_cell = cells.get((col_idx, row_idx))
+        old_value = parse_number(None if old_cell is None else old_cell.formatted_value or old_cell.value)
+        new_value = old_value + weight
+        if isinstance(new_value, float):
+            new_value = round(new_value, 3)
+        return Cell(value=new_value, note=note, col_idx=col_idx, row_idx=row_idx)
+
+    @staticmethod
+    def _sales_log_row(sale: Sale, date: datetime.date) -> list[Cell]:
+        return [
+            Cell(value=date.strftime('%d.%m.%Y')),
+            Cell(value=sale.plu),
+            Cell(value=sale.customer),
+            Cell(value=sale.weight),
+        ]
+
+    def create_sales_log(self, title: str = SALES_LOG_TITLE) -> int:
+        """
+        Creates the sales log sheet and its summary, sales are appended to the log since then.
+        Returns gid of the log
+        """
+        gid = max(sheet.id for sheet in self._google.sheets) + 1
+        with tracer.span('create sales log'):
+            self._google.batch_update(sales_log_requests(title, gid))
+        self.sales_log_gid = gid
+        return gid
+
+    def _apply_sales(self, sales: list[Sale], sheet_date: SheetDate, rows: dict[int, RowIdx],
+                     cells: dict[tuple[ColIdx, RowIdx], Cell]) -> list[Cell]:
+        """
+        Sales to named customers go to their columns, the others are added
+        to sale column with per-customer weights kept in its note.
+        With the sales log the note is left as it is, customers are in the log
+        """
+        sale_col_idx, sale_sum_col_idx = self._find_cols_indexes('Реализация', 'Реализация сумма', target=sheet_date)
+        plus = {s.plu: s for s in sales}
 
         new_sales: list[Cell] = []
-        for data in plus.values():
-            sale: Sale = data['sale']
-            row_idx: RowIdx = data['row_idx']
-            customers: dict[str, int | float] = {}
-            if sale.customer in ('Гл. Дом', 'Кинологи', 'Благотворительность', 'Утилизация'):
-                target_idx: int = -1
-                match sale.customer:
-                    case 'Гл. Дом':
-                        target_idx = main_dom_col_idx
-                    case 'Кинологи':
-                        target_idx = kino_col_idx
-                    case 'Благотворительность':
-                        target_idx = blago_col_idx
-                    case 'Утилизация':
-                        target_idx = util_col_idx
-                if target_idx is None:
-                    if self._logger is not None:
-                        self._logger.warning(f'No such column "{sale.customer}"')
-                    else:
-                        print(f'No such column "{sale.customer}"')
-                else:
-                    cols = other_cells[row_idx]
-                    old_value = 0
-                    for c in cols:
-                        if c.col_idx == target_idx:
-                            value = c.formatted_value or c.value
-                            if value is None:
-                                old_value = 0
-                            elif isinstance(value, str) and value.isdigit():
-                                old_value = int(value)
-                            elif isinstance(value, str):
-                                value = value.replace(',', '.') if ',' in value else value
-                                old_value = float(value)
-                            else:
-                                old_value = value
-                            break
-                    new_value = old_value + sale.weight
-                    if isinstance(new_value, float):
-                        new_value = round(new_value, 3)
-                    new_cell = Cell(value=new_value, row_idx=row_idx, col_idx=target_idx)
-                    new_sales.append(new_cell)
+        for sale in plus.values():
+            row_idx = rows[sale.plu]
+            if sale.customer in SALE_CUSTOMER_COLS:
+                target_idx = self._find_cols_indexes(sale.customer, target=sheet_date)[0]
+                if target_idx is not None:
+                    new_sales.append(self._increment(cells, target_idx, row_idx, sale.weight))
                     continue
-            try:
-                old_sale: Cell = old_sales[row_idx]
-                note = old_sale.note
-                if note is not None:
-                    for row in note.split('\n'):
-                        customer, weight = row.split(' - ')
-                        weight = int(weight) if weight.isdigit() else float(weight)
-                        customers[customer] = weight
-
-                old_value = old_sale.formatted_value or old_sale.value
-            except KeyError:
-                old_value = 0
-
-            if old_value is None:
-                old_value = 0
-            if isinstance(old_value, str):
-                if old_value.isdigit():
-                    old_value = int(old_value)
+                if self._logger is not None:
+                    self._logger.warning(f'No such column "{sale.customer}"')
                 else:
-                    if ',' in old_value:
-                        old_value = old_value.replace(',', '.')
-                    old_value = float(old_value)
+                    print(f'No such column "{sale.customer}"')
 
-            if sale.customer in customers:
-                customers[sale.customer] += sale.weight
-            else:
-                customers[sale.customer] = sale.weight
+            if self.sales_log_gid is not None:
+                new_cell = self._increment(cells, sale_col_idx, row_idx, sale.weight)
+                new_sales.extend((new_cell, self._sale_sum_cell(new_cell, sale_sum_col_idx)))
+                continue
+
+            old_sale = cells.get((sale_col_idx, row_idx))
+            customers = self._note_customers(None if old_sale is None else old_sale.note)
+            customers[sale.customer] = customers.get(sale.customer, 0) + sale.weight
             if isinstance(customers[sale.customer], float):
                 customers[sale.customer] = round(customers[sale.customer], 3)
 
-            new_value = sale.weight + old_value
-            if isinstance(new_value, float):
-                new_value = round(new_value, 3)
             new_note = '\n'.join(f'{customer} - {weight}' for customer, weight in customers.items())
-            new_cell = Cell(value=new_value, note=new_note, col_idx=sale_col_idx, row_idx=row_idx)
-            price_cell = Cell(col_idx=2, row_idx=row_idx)
-            sum_formula = f'={new_cell.name} * {price_cell.name}'
-            new_cell_sum = Cell(value=sum_formula, col_idx=sale_sum_col_idx, row_idx=row_idx)
+            new_cell = self._increment(cells, sale_col_idx, row_idx, sale.weight, note=new_note)
+            new_sales.extend((new_cell, self._sale_sum_cell(new_cell, sale_sum_col_idx)))
+        return new_sales
+
+    @staticmethod
+    def _note_customers(note: str | None) -> dict[str, int | float]:
+        """
+        Weights by customer kept in the note of a sale cell, "customer - weight" per line
+        """
+        customers: dict[str, int | float] = {}
+        if note:
+            for row in note.split('\n'):
+                customer, weight = row.split(' - ')
+                customers[customer] = int(weight) if weight.isdigit() else float(weight)
+        return customers
+
+    @staticmethod
+    def _sale_sum_cell(sale_cell: Cell, sale_sum_col_idx: ColIdx) -> Cell:
+        price_cell = Cell(col_idx=2, row_idx=sale_cell.row_idx)
+        return Cell(value=f'={sale_cell.name} * {price_cell.name}', col_idx=sale_sum_col_idx, row_idx=sale_cell.row_idx)
+
+    def create_shipment(self, shipments: list[Shipment], date: datetime.date | None = None):
+        """
+        Cerate new shipments and update google spreadsheet
+        """
+        self._submit('shipment', shipments, date)
+
+    def create_income(self, incomes: list[Income], date: datetime.date | None = None):
+        """
+        Create new income and update google spreadsheet
+        """
+        self._submit('income', incomes, date)
+
+    def create_sale(self, sales: list[Sale], date: datetime.date | None = None):
+        """
+        Create new sale and update google spreadsheet
+        """
+        self._submit('sale', sales, date)
+
+    def do_inventory(self, inventories: list[Inventory], date: datetime.date | None = None):
+        """
+        Do inverntory
+        """
+        self._submit('inventory', inventories, date)
+
+    def read_totals(self) -> dict[datetime.date, dict[int, dict[tuple[str, str | None], int | float]]]:
+        """
+        Values of operation columns of all dates as ledger totals, {date: {plu: {(kind, customer): weight}}},
+        read in one request. Sales of the sale column are split by customers of its note and of the sales log,
+        the rest of it has customer None. Opening balances of a partition are not operations and are skipped
+        """
+        dates = [sd for sd in self.dates if self.period_start is None or sd.date >= self.period_start]
+        if not dates or not self.products:
+            return {}
+        self._load_headers(dates)
+        rows = {p.row_idx: p.plu for p in self.products}
+        ranges = [
+            (Cell(col_idx=sd.col_idx, row_idx=min(rows)), Cell(col_idx=sd.col_idx + sd.wide - 1, row_idx=max(rows)))
+            for sd in dates
+        ]
+        with tracer.span('read old values'):
+            cells = {(c.col_idx, c.row_idx): c for c in self._google.get_values_batch(ranges, sheet_id=self.gid)}
+        logged = self._read_sales_log() if self.sales_log_gid is not None else {}
+        totals: dict[datetime.date, dict[int, dict[tuple[str, str | None], int | float]]] = {}
+        for sd in dates:
+            for row_idx, plu in rows.items():
+                by_kind: dict[tuple[str, str | None], int | float] = {}
+                for kind, names in OPERATION_COLS.items():
+                    for name in names:
+                        col_idx = sd.find_col_idx(name)
+                        cell = cells.get((col_idx, row_idx))
+                        if name == 'Реализация сумма' or cell is None:
+                            continue
+                        raw = cell.formatted_value or cell.value
+                        if raw is None or raw == '':
+                            continue
+                        value = parse_number(raw)
+                        if name in SALE_CUSTOMER_COLS:
+                            by_kind[(kind, name)] = value
+                        elif name == 'Реализация':
+                            customers = self._note_customers(cell.note)
+                            for customer, weight in logged.get((sd.date, plu), {}).items():
+                                if customer in SALE_CUSTOMER_COLS and sd.find_col_idx(customer) is not None:
+                                    continue  # it is in its own column
+                                customers[customer] = round(customers.get(customer, 0) + weight, 3)
+                            by_kind.update(((kind, customer), weight) for customer, weight in customers.items())
+                            rest = round_weight(value - sum(customers.values()))
+                            if rest:
+                                by_kind[(kind, None)] = rest
+                        else:
+                            by_kind[(kind, None)] = value
+                if by_kind:
+                    totals.setdefault(sd.date, {})[plu] = by_kind
+        return totals
+
+    def _read_sales_log(self) -> dict[tuple[datetime.date, int], dict[str, int | float]]:
+        """
+        Sold weights by (date, PLU) and customer from the sales log sheet
+        """
+        rows: dict[int, dict[int, Any]] = {}
+        for c in self._google.get_values(sheet_id=self.sales_log_gid, from_='A2', to='D'):
+            rows.setdefault(c.row_idx, {})[c.col_idx] = c.formatted_value or c.value
+        logged: dict[tuple[datetime.date, int], dict[str, int | float]] = {}
+        for row in rows.values():
+            date, plu, customer, weight = (row.get(i) for i in range(len(SALES_LOG_HEADER)))
+            if not date or not plu or not customer:
+                continue
+            customers = logged.setdefault((datetime.datetime.strptime(date, '%d.%m.%Y').date(), int(plu)), {})
+            customers[customer] = round(customers.get(customer, 0) + parse_number(weight), 3)
+        return logged
 
-            new_sales.append(new_cell)
-            new_sales.append(new_cell_sum)
-        self._google.update_cells(new_sales, self.gid)
+    def render(self, totals: dict[datetime.date, dict[int, dict[tuple[str, str | None], int | float]]]) -> None:
+        """
+        Writes totals of a ledger, {date: {plu: {(kind, customer): weight}}}, over cells of their dates.
+        Unlike create_* methods values are set, not added, so rendering can be repeated.
+        Missing dates are created, then cells of all dates are written in one request
+        """
+        if not totals:
+            return
+        index = self.plu_index
+        missing = sorted({plu for by_plu in totals.values() for plu in by_plu if plu not in index})
+        if missing:
+            raise ValueError(f'No such PLU in spreadsheet: {", ".join(map(str, missing))}')
+        for date in sorted(totals):
+            sheet_date = self.create_date(date)
+            has_inventory = any(kind == 'inventory' for by_kind in totals[date].values() for kind, _ in by_kind)
+            if has_inventory and self._find_cols_indexes('Инвентаризация', target=sheet_date)[0] is None:
+                self.append_col(date, 'Инвентаризация')
+
+        cells: list[Cell] = []
+        for date, by_plu in totals.items():
+            sheet_date = self.dates[self._binary_dates_srch(date)]
+            self._load_headers([sheet_date])
+            for plu, by_kind in by_plu.items():
+                row_idx = index[plu]
+                values: dict[str, int | float] = {}
+                customers: dict[str, int | float] = {}
+                for (kind, customer), weight in by_kind.items():
+                    name = OPERATION_COLS[kind][0]
+                    if kind == 'sale':
+                        if customer in SALE_CUSTOMER_COLS and sheet_date.find_col_idx(customer) is not None:
+                            name = customer
+                        else:
+                            customers[customer] = weight
+                    values[name] = round(values.get(name, 0) + weight, 3)
+                for name, value in values.items():
+                    note = None
+                    if name == 'Реализация':
+                        # sales imported from the spreadsheet without a customer are not in the note
+                        note = '\n'.join(
+                            f'{customer} - {weight}' for customer, weight in customers.items() if customer is not None
+                        )
+                    cells.append(Cell(value=value, note=note, col_idx=sheet_date.find_col_idx(name), row_idx=row_idx))
+                if 'Реализация' in values:
+                    sale_cell = Cell(col_idx=sheet_date.find_col_idx('Реализация'), row_idx=row_idx)
+                    price_cell = Cell(col_idx=2, row_idx=row_idx)
+                    cells.append(Cell(
+                        value=f'={sale_cell.name} * {price_cell.name}',
+                        col_idx=sheet_date.find_col_idx('Реализация сумма'),
+                        row_idx=row_idx,
+                    ))
+        with tracer.span('write'):
+            self._google.update_cells(cells, self.gid)
+        for date, by_plu in totals.items():
+            for plu, by_kind in by_plu.items():
+                self.index.set_date(plu, date, by_kind)
+        self._refresh_checkpoints(min(totals))
+
+    def _ensure_index(self) -> None:
+        """
+        Loads the stock index from values of the spreadsheet once, if it was not loaded from a ledger
+        """
+        if not self.index.loaded:
+            with tracer.span('load index'):
+                self.index.load(self.read_totals())
+
+    def stock(self, plu: int, date: datetime.date) -> int | float:
+        """
+        Remainder of the PLU at the end of the date from the local index, see StockIndex
+        """
+        self._ensure_index()
+        return self.index.stock(plu, date)
+
+    def sales(self, plu: int, start: datetime.date, end: datetime.date, customer: str | None = None) -> int | float:
+        """
+        Sales of the PLU from start to end (inclusive) from the local index, see StockIndex
+        """
+        self._ensure_index()
+        return self.index.sales(plu, start, end, customer)
+
+    def _month_dates(self, sheet_month: SheetMonth) -> list[SheetDate]:
+        """
+        Dates summed by the month summary block
+        """
+        return [
+            sd for sd in self.dates
+            if sd.date.month == sheet_month.month and (sheet_month.year is None or sd.date.year == sheet_month.year)
+        ]
 
-    def update_month(self, month: int | Literal['last_date']):
+    def update_month(self, month: int | Literal['last_date'], year: int | None = None):
+        """
+        Writes month summary formulas.
+        Only summary columns whose set of referenced date columns changed are written
+        """
         if month == 'last_date':
-            month = self.dates[-1].date.month
-        int_months = [m.month for m in self.months]
-        index = int_months.index(month) # noqa
-        sheet_month = self.months[index]
+            month, year = self.dates[-1].date.month, self.dates[-1].date.year
+        sheet_month = self.month_block(month, year)
+        if sheet_month is None:
+            raise ValueError(f'No summary block of month {month}')
+
+        needed_dates = self._month_dates(sheet_month)
+        self._load_headers(needed_dates)
+        if self._summary_mode == 'range':
+            self._update_month_range(sheet_month, needed_dates)
+            return
+        cols_by_name, refs = self._month_cols(needed_dates)
+
+        cached_refs = self._month_refs.get(sheet_month.block_key())
+        if cached_refs is None:
+            cached_refs = self._read_month_refs(sheet_month, needed_dates)
+        changed = [name for name in MONTH_COLS if cached_refs.get(name) != refs[name]]
+        if not changed:
+            self._month_refs[sheet_month.block_key()] = refs
+            return
 
-        needed_dates = [sd for sd in self.dates if sd.date.month == month]
-        (
-            shipment_cols,
-            income_cols,
-            sale_cols,
-            sale_sum_cols,
-            main_dom_cols,
-            kino_cols,
-            blago_cols,
-            util_cols
-         ) = [], [], [], [], [], [], [], []
+        new_cells = [
+            self._month_cell(sheet_month, name, cols_by_name[name], p.row_idx) for p in self.products for name in changed
+        ]
+        self._google.update_cells(new_cells, self.months_gid)
+        self._month_refs[sheet_month.block_key()] = refs
+
+    def _month_cols(self, needed_dates: list[SheetDate]) -> tuple[dict[str, list[ColIdx]], dict[str, tuple[str, ...]]]:
+        """
+        Columns of the dates summed by every month summary column and keys of their blocks
+        """
+        cols_by_name: dict[str, list[ColIdx]] = {name: [] for name in MONTH_COLS}
+        refs: dict[str, tuple[str, ...]] = {name: () for name in MONTH_COLS}
         for sd in needed_dates:
-            (
-                shipment_col_idx,
-                income_col_idx,
-                sale_col_idx,
-                sale_sum_col_idx,
-                main_dom_col_idx,
-                kino_col_idx,
-                blago_col_idx,
-                util_col_idx,
-            ) = self._find_cols_indexes(  # noqa
-                'Отгрузка',
-                'Приход',
-                'Реализация',
-                'Реализация сумма',
-                'Гл. Дом',
-                'Кинологи',
-                'Благотворительность',
-                'Утилизация',
-                target=sd
-            )
-            shipment_cols.append(shipment_col_idx)
-            income_cols.append(income_col_idx)
-            sale_cols.append(sale_col_idx)
-            sale_sum_cols.append(sale_sum_col_idx)
-            main_dom_cols.append(main_dom_col_idx)
-            kino_cols.append(kino_col_idx)
-            blago_cols.append(blago_col_idx)
-            util_cols.append(util_col_idx)
+            col_indexes = self._find_cols_indexes(*MONTH_COLS, target=sd)
+            for name, col_idx in zip(MONTH_COLS, col_indexes):
+                if col_idx is not None:
+                    cols_by_name[name].append(col_idx)
+                    refs[name] += (sd.block_key(),)
+        return cols_by_name, refs
+
+    def _month_cell(self, sheet_month: SheetMonth, name: str, col_indexes: list[ColIdx], row_idx: RowIdx) -> Cell:
+        formula = '=' + ' + '.join(self._date_ref(col_idx, row_idx) for col_idx in col_indexes)
+        formula = None if formula == '=' else formula
+        return Cell(value=formula, col_idx=sheet_month.col_idx + MONTH_OFFSETS[name], row_idx=row_idx)
+
+    def _load_named_ranges(self) -> dict[str, dict]:
+        if self._named_ranges is None:
+            self._named_ranges = {nr['name']: nr for nr in self._google.get_named_ranges()}
+        return self._named_ranges
+
+    def _range_name(self, month: int, year: int | None) -> str:
+        if year is None:
+            return f'month_{self.gid}_{month:02d}'
+        return f'month_{self.gid}_{year}_{month:02d}'
+
+    def _month_range_name(self, sheet_month: SheetMonth) -> str:
+        """
+        Named range of the month block in 'range' summary mode, the name has the year of the block.
+        A range named without year by earlier versions stays with the block whose dates it covers.
+        The name is stored in metadata of the block
+        """
+        if sheet_month.range_name is not None:
+            return sheet_month.range_name
+        name = legacy = self._range_name(sheet_month.month, None)
+        if sheet_month.year is not None:
+            name = self._range_name(sheet_month.month, sheet_month.year)
+            named_ranges = self._load_named_ranges()
+            legacy_range = named_ranges.get(legacy)
+            if name not in named_ranges and legacy_range is not None:
+                start_col_idx = legacy_range['range'].get('startColumnIndex')
+                if start_col_idx in {sd.col_idx for sd in self._month_dates(sheet_month)}:
+                    name = legacy
+        sheet_month.range_name = name
+        self._retag(sheet_month)
+        return name
+
+    def _update_month_range(self, sheet_month: SheetMonth, needed_dates: list[SheetDate]) -> None:
+        """
+        'range' summary mode: formulas refer to the month named range and never change,
+        adding a date only moves the range bounds
+        """
+        if not needed_dates:
+            return
+        name = self._month_range_name(sheet_month)
+        start_col_idx = min(sd.col_idx for sd in needed_dates)
+        end_col_idx = max(sd.col_idx + sd.wide for sd in needed_dates)
+        month_range = grid_range(self.gid, start_row=1, start_col=start_col_idx, end_col=end_col_idx)
+
+        named_range = self._load_named_ranges().get(name)
+        if named_range is not None:
+            current = named_range['range']
+            if (current.get('startColumnIndex'), current.get('endColumnIndex')) != (start_col_idx, end_col_idx):
+                self._google.update_named_range(named_range['namedRangeId'], name, month_range)
+                named_range['range'] = month_range
+            return
 
         new_cells = []
         for p in self.products:
-            shipment_formula = '=' + ' + '.join(Cell(col_idx=col_idx, row_idx=p.row_idx).name for col_idx in shipment_cols if col_idx is not None)
-            income_formula = '=' + ' + '.join(Cell(col_idx=col_idx, row_idx=p.row_idx).name for col_idx in income_cols if col_idx is not None)
-            sale_formula = '=' + ' + '.join(Cell(col_idx=col_idx, row_idx=p.row_idx).name for col_idx in sale_cols if col_idx is not None)
-            sale_sum_formula = '=' + ' + '.join(Cell(col_idx=col_idx, row_idx=p.row_idx).name for col_idx in sale_sum_cols if col_idx is not None)
-            main_dom_formula = '=' + ' + '.join(Cell(col_idx=col_idx, row_idx=p.row_idx).name for col_idx in main_dom_cols if col_idx is not None)
-            kino_formula = '=' + ' + '.join(Cell(col_idx=col_idx, row_idx=p.row_idx).name for col_idx in kino_cols if col_idx is not None)
-            blago_formula = '=' + ' + '.join(Cell(col_idx=col_idx, row_idx=p.row_idx).name for col_idx in blago_cols if col_idx is not None)
-            util_formula = '=' + ' + '.join(Cell(col_idx=col_idx, row_idx=p.row_idx).name for col_idx in util_cols if col_idx is not None)
-
-            shipment_formula = None if shipment_formula == '=' else shipment_formula
-            income_formula = None if income_formula == '=' else income_formula
-            sale_formula = None if sale_formula == '=' else sale_formula
-            sale_sum_formula = None if sale_sum_formula == '=' else sale_sum_formula
-            main_dom_formula = None if main_dom_formula == '=' else main_dom_formula
-            kino_formula = None if kino_formula == '=' else kino_formula
-            blago_formula = None if blago_formula == '=' else blago_formula
-            util_formula = None if util_formula == '=' else util_formula
-
-            shipment_cell = Cell(value=shipment_formula, col_idx=sheet_month.col_idx, row_idx=p.row_idx)
-            income_cell = Cell(value=income_formula, col_idx=sheet_month.col_idx + 1, row_idx=p.row_idx)
-            sale_cell = Cell(value=sale_formula, col_idx=sheet_month.col_idx + 2, row_idx=p.row_idx)
-            sale_sum_cell = Cell(value=sale_sum_formula, col_idx=sheet_month.col_idx + 3, row_idx=p.row_idx)
-            main_dom_cell = Cell(value=main_dom_formula, col_idx=sheet_month.col_idx + 4, row_idx=p.row_idx)
-            kino_cell = Cell(value=kino_formula, col_idx=sheet_month.col_idx + 5, row_idx=p.row_idx)
-            blago_cell = Cell(value=blago_formula, col_idx=sheet_month.col_idx + 6, row_idx=p.row_idx)
-            util_cell = Cell(value=util_formula, col_idx=sheet_month.col_idx + 7, row_idx=p.row_idx)
-
-            new_cells.extend(
-                [shipment_cell, income_cell, sale_cell, sale_sum_cell, main_dom_cell, kino_cell, blago_cell, util_cell]
-            )
-        self._google.update_cells(new_cells, self.gid)
-
-    def summarize_month(self, month: int | Literal['last_date'], update_exist: bool = False):
+            for offset, col_name in enumerate(MONTH_COLS):
+                formula = RANGE_SUMMARY_FORMULA.format(range=name, name=col_name)
+                new_cells.append(Cell(value=formula, col_idx=sheet_month.col_idx + offset, row_idx=p.row_idx))
+        # named range and formulas referring to it go in one batch
+        requests = [add_named_range_request(name, month_range), *update_cells_requests(new_cells, self.gid)]
+        response = self._google.batch_update(requests)
+        self._named_ranges[name] = response['replies'][0]['addNamedRange']['namedRange']
+
+    def _read_month_refs(self, sheet_month: SheetMonth, needed_dates: list[SheetDate]) -> dict[str, tuple[str, ...]]:
+        """
+        Restores referenced date blocks of month summary columns
+        from formulas of the first product row
+        """
+        if not self.products:
+            return {}
+        row_idx = self.products[0].row_idx
+        from_cell = Cell(col_idx=sheet_month.col_idx, row_idx=row_idx)
+        to_cell = Cell(col_idx=sheet_month.col_idx + len(MONTH_COLS) - 1, row_idx=row_idx)
+        refs: dict[str, tuple[str, ...]] = {}
+        for c in self._google.get_values(sheet_id=self.months_gid, from_=from_cell, to=to_cell):
+            offset = c.col_idx - sheet_month.col_idx
+            if not isinstance(c.value, str) or not c.value.startswith('=') or offset >= len(MONTH_COLS):
+                continue
+            keys: tuple[str, ...] = ()
+            for ref in c.value[1:].split('+'):
+                col_idx, _ = Cell.find_indexes(ref.split('!')[-1].strip())
+                sd = next((sd for sd in needed_dates if sd.col_idx <= col_idx < sd.col_idx + sd.wide), None)
+                if sd is None:  # not a plain sum of our columns, rewrite it
+                    keys = ()
+                    break
+                keys += (sd.block_key(),)
+            refs[MONTH_COLS[offset]] = keys
+        return refs
+
+    def summarize_month(self, month: int | Literal['last_date'], update_exist: bool = False, year: int | None = None):
         if month == 'last_date':
-            month = self.dates[-1].date.month
+            month, year = self.dates[-1].date.month, self.dates[-1].date.year
 
-        int_months = [m.month for m in self.months]
-        if month in int_months:
+        if self.month_block(month, year) is not None:
             if update_exist is True:
-                self.update_month(month)
+                self.update_month(month, year)
+            return
+        if self._layout == 'append':
+            self._append_month(month, year)
             return
 
         # calculating last needed date
         last_sheet_date = None
         for sd in self.dates:
-            if month < sd.date.month:
-                break
-            if sd.date.month == month:
+            if sd.date.month == month and (year is None or sd.date.year == year):
                 last_sheet_date = sd
+        year = last_sheet_date.date.year
 
-        _, row_count = self._google.get_size_of_sheet(self.gid)
-        insert_range = lambda: self._google.insert_range( # noqa
-            from_cell=Cell(col_idx=last_sheet_date.col_idx + last_sheet_date.wide, row_idx=0),
-            to_cell=Cell(col_idx=last_sheet_date.col_idx + last_sheet_date.wide + 3, row_idx=row_count),
-            shift_dimension='COLUMNS',
-            sheet_id=self.gid
-        )
-        self._google.append_dimension('COLUMNS', self.gid, 8)
-        insert_range()
-        index = self.dates.index(last_sheet_date)
-        for i in range(index + 1, len(self.dates)):
-            self.dates[i].col_idx += 4
-        from_cell = Cell(
-            value=SEASONS[month-1],
-            bold=True,
-            col_idx=last_sheet_date.col_idx + last_sheet_date.wide,
-            row_idx=0,
-        )
-        new_cells = [
-            from_cell,
-            Cell(value='Отгрузка', col_idx=from_cell.col_idx, row_idx=1), # noqa
-            Cell(value='Приход', col_idx=from_cell.col_idx, row_idx=1), # noqa
-            Cell(value='Реализация', col_idx=from_cell.col_idx, row_idx=1), # noqa
-            Cell(value='Реализация сумма', col_idx=from_cell.col_idx, row_idx=1), # noqa
-            Cell(value='Гл. Дом', col_idx=from_cell.col_idx, row_idx=1), # noqa
-            Cell(value='Кинологи', col_idx=from_cell.col_idx, row_idx=1), # noqa
-            Cell(value='Благотворительность', col_idx=from_cell.col_idx, row_idx=1), # noqa
-            Cell(value='Утилизация', col_idx=from_cell.col_idx, row_idx=1), # noqa
+        sheet_month = self._new_sheet_month(month, last_sheet_date.col_idx + last_sheet_date.wide, year)
+        requests = [
+            insert_dimension_request(self.gid, 'COLUMNS', sheet_month.col_idx, sheet_month.col_idx + sheet_month.wide),
+            *self._header_requests(sheet_month, self.gid),
+            {'createDeveloperMetadata': {'developerMetadata': self._block_metadata(sheet_month)}},
         ]
-        self._google.update_cells(new_cells, self.gid)
-        sheet_month = SheetMonth(
-            name=SEASONS[month-1],
-            col_idx=last_sheet_date.col_idx + last_sheet_date.wide,
-            row_idx=0,
-            month=month, # noqa
-            wide=8,
-            cols=[
-                UnderDateColumn(name='Отгрузка', col_idx=from_cell.col_idx, row_idx=1),
-                UnderDateColumn(name='Приход', col_idx=from_cell.col_idx + 1, row_idx=1),
-                UnderDateColumn(name='Реализация', col_idx=from_cell.col_idx + 2, row_idx=1),
-                UnderDateColumn(name='Реализация сумма', col_idx=from_cell.col_idx + 3, row_idx=1),
-                UnderDateColumn(name='Гл. Дом', col_idx=from_cell.col_idx + 4, row_idx=1),
-                UnderDateColumn(name='Кинологи', col_idx=from_cell.col_idx + 5, row_idx=1),
-                UnderDateColumn(name='Благотворительность', col_idx=from_cell.col_idx + 6, row_idx=1),
-                UnderDateColumn(name='Утилизация', col_idx=from_cell.col_idx + 7, row_idx=1),
-            ]
-        )
-        self.months.insert(month-1, sheet_month)
-        for sd in self.dates:
-            if month < sd.date.month:
-                sd.add_col_idx(8)
-        for sm in self.months:
-            if month < sm.month:
-                sm.add_col_idx(8)
-        self.update_month(month)
-
-    def do_inventory(self, inventories: list[Inventory], date: datetime.date | None = None):
+        self._layout_changed = True
+        response = self._google.batch_update(requests)
+        sheet_month.meta_id = response['replies'][-1]['createDeveloperMetadata']['developerMetadata']['metadataId']
+        self._shift_blocks(sheet_month.col_idx, sheet_month.wide)
+        self._add_month(sheet_month)
+        self._month_refs[sheet_month.block_key()] = {}  # new block has no formulas yet
+        self.update_month(month, year)
+
+    def _append_month(self, month: int, year: int | None = None) -> None:
         """
-        Do inverntory
+        Append layout: puts month summary block at the right edge of the summary sheet.
+        The first block also gets product columns referring to the dates sheet
         """
-        sheet_date = self.create_date(date)
-        inventory_col_idx = self._find_cols_indexes('Инвентаризация', target=sheet_date)[0]
-        if inventory_col_idx is None:
-            inventory_col_idx = self.append_col(date, 'Инвентаризация')
-            index = self.dates.index(sheet_date)
-            try:
-                next_sheet_date = self.dates[index+1]
-                self.update_date(next_sheet_date)
-            except IndexError:
-                pass
-        plus = {i.plu: {'inventory': i, 'row_idx': -1} for i in inventories}
-        for p in self.products:
-            if p.plu in plus:
-                plus[p.plu]['row_idx'] = p.row_idx
-
-        from_cell = Cell(col_idx=inventory_col_idx, row_idx=min(v['row_idx'] for v in plus.values() if v['row_idx'] != -1))
-        to_cell = Cell(col_idx=inventory_col_idx, row_idx=max(v['row_idx'] for v in plus.values() if v['row_idx'] != -1))
-
-        old_inventories_gen = self._google.get_values(sheet_id=self.gid, from_=from_cell, to=to_cell)
-        old_inventories = {c.row_idx: c for c in old_inventories_gen}
-
-        new_inventories: list[Cell] = []
-        for data in plus.values():
-            income: Inventory = data['inventory']
-            row_idx: RowIdx = data['row_idx']
-            try:
-                old_inventory: Cell = old_inventories[row_idx]
-                old_value = old_inventory.formatted_value or old_inventory.value
-            except KeyError:
-                old_value = 0
-
-            if old_value is None:
-                old_value = 0
-            if isinstance(old_value, str):
-                if old_value.isdigit():
-                    old_value = int(old_value)
-                else:
-                    old_value = old_value.replace(',', '.') if ',' in old_value else old_value
-                    old_value = float(old_value)
-            new_value = income.weight + old_value
-            if isinstance(new_value, float):
-                new_value = round(new_value, 3)
-            new_cell = Cell(value=new_value, col_idx=inventory_col_idx, row_idx=row_idx)
-            new_inventories.append(new_cell)
-        self._google.update_cells(new_inventories, self.gid)
+        col_idx = max((sm.col_idx + sm.wide for sm in self.months), default=4)
+        sheet_month = self._new_sheet_month(month, col_idx, year)
+        cells = []
+        if not self.months:
+            for p in self.products:
+                cells.extend(
+                    Cell(value=f'={self._date_ref(product_col_idx, p.row_idx)}', col_idx=product_col_idx, row_idx=p.row_idx)
+                    for product_col_idx in range(3)
+                )
+        requests = [
+            insert_dimension_request(self.summary_gid, 'COLUMNS', col_idx, col_idx + sheet_month.wide),
+            *self._header_requests(sheet_month, self.summary_gid),
+            *(update_cells_requests(cells, self.summary_gid) if cells else []),
+            {'createDeveloperMetadata': {'developerMetadata': self._block_metadata(sheet_month)}},
+        ]
+        response = self._google.batch_update(requests)
+        sheet_month.meta_id = response['replies'][-1]['createDeveloperMetadata']['developerMetadata']['metadataId']
+        self._add_month(sheet_month)
+        self._month_refs[sheet_month.block_key()] = {}  # new block has no formulas yet
+        self.update_month(month, year)
@@ -0,0 +1,164 @@
+import bisect
+import datetime
+
+# sale customers whose sales are write-offs with their own sub-column
+WRITE_OFF_CUSTOMERS = ('Гл. Дом', 'Кинологи', 'Благотворительность', 'Утилизация')
+
+
+def round_weight(value: int | float) -> int | float:
+    """
+    Weight rounded to grams, whole weights as int
+    """
+    value = round(value, 3)
+    return int(value) if float(value).is_integer() else value
+
+
+class _Series:
+    """
+    Per-date totals of one PLU with prefix sums, which are rebuilt lazily
+    from the first changed date, so appending dates costs O(1)
+    """
+    def __init__(self) -> None:
+        self.dates: list[datetime.date] = []
+        self.fields: dict[str, list[float]] = {}
+        self.prefix: dict[str, list[float]] = {}
+        self.valid = 0  # number of dates whose prefix sums are up to date
+        self.inventory: dict[datetime.date, float] = {}
+        self.inventory_dates: list[datetime.date] = []
+
+    def _index(self, date: datetime.date) -> int:
+        i = bisect.bisect_left(self.dates, date)
+        if i == len(self.dates) or self.dates[i] != date:
+            self.dates.insert(i, date)
+            for values in self.fields.values():
+                values.insert(i, 0)
+        self.valid = min(self.valid, i)
+        return i
+
+    def add(self, field: str, date: datetime.date, weight: int | float) -> None:
+        i = self._index(date)
+        if field not in self.fields:
+            self.fields[field] = [0] * len(self.dates)
+        self.fields[field][i] += weight
+
+    def clear(self, date: datetime.date) -> None:
+        i = self._index(date)
+        for values in self.fields.values():
+            values[i] = 0
+        self.set_inventory(date, None)
+
+    def add_inventory(self, date: datetime.date, weight: int | float) -> None:
+        self.set_inventory(date, self.inventory.get(date, 0) + weight)
+
+    def set_inventory(self, date: datetime.date, value: int | float | None) -> None:
+        if value is None:
+            if self.inventory.pop(date, None) is not None:
+                self.inventory_dates.remove(date)
+            return
+        if date not in self.inventory:
+            bisect.insort(self.inventory_dates, date)
+        self.inventory[date] = value
+
+    def total(self, field: str, start: int, end: int) -> float:
+        """
+        Sum of the field over dates[start:end]
+        """
+        values = self.fields.get(field)
+        if values is None:
+            return 0
+        if self.valid < len(self.dates):
+            for name, field_values in self.fields.items():
+                prefix = self.prefix.setdefault(name, [0])
+                del prefix[self.valid + 1:]
+                prefix.extend([0] * (len(self.dates) + 1 - len(prefix)))
+                for i in range(self.valid, len(self.dates)):
+                    prefix[i + 1] = prefix[i] + field_values[i]
+            self.valid = len(self.dates)
+        prefix = self.prefix[field]
+        return prefix[end] - prefix[start]
+
+
+class StockIndex:
+    """
+    Local index of applied operations: per-PLU prefix sums of income, sales and write-offs by date,
+    so stock and sales over a date range are answered in O(log n) without reading the spreadsheet.
+    Stock follows the remainder formula: the last inventory resets it, shipments do not change it.
+    Only operations the index was fed with are counted, so it answers only after all of them are loaded
+    """
+    def __init__(self) -> None:
+        self._series: dict[int, _Series] = {}
+        self.loaded = False
+
+    def _get(self, plu: int) -> _Series:
+        if plu not in self._series:
+            self._series[plu] = _Series()
+        return self._series[plu]
+
+    def add(self, kind: str, plu: int, date: datetime.date, weight: int | float, customer: str | None = None) -> None:
+        """
+        Feeds one product of an applied operation
+        """
+        series = self._get(plu)
+        if kind == 'income':
+            series.add('income', date, weight)
+            series.add('net', date, weight)
+        elif kind == 'shipment':
+            series.add('shipment', date, weight)
+        elif kind == 'sale':
+            series.add('write_off' if customer in WRITE_OFF_CUSTOMERS else 'sale', date, weight)
+            series.add(f'customer:{customer}', date, weight)
+            series.add('net', date, -weight)
+        elif kind == 'inventory':
+            series.add_inventory(date, weight)
+
+    def set_date(self, plu: int, date: datetime.date, totals: dict[tuple[str, str | None], int | float]) -> None:
+        """
+        Replaces totals of the PLU at the date, {(kind, customer): weight} as rendered from a ledger
+        """
+        series = self._get(plu)
+        series.clear(date)
+        for (kind, customer), weight in totals.items():
+            self.add(kind, plu, date, weight, customer)
+
+    def load(self, totals: dict[datetime.date, dict[int, dict[tuple[str, str | None], int | float]]]) -> None:
+        """
+        Replaces totals of given dates, see Ledger.totals and AccountingSpreadsheet.read_totals
+        """
+        for date, by_plu in totals.items():
+            for plu, by_kind in by_plu.items():
+                self.set_date(plu, date, by_kind)
+        self.loaded = True
+
+    def _check_loaded(self) -> None:
+        if not self.loaded:
+            raise ValueError('Stock index is not loaded, operations it was not fed with would be missed')
+
+    def stock(self, plu: int, date: datetime.date) -> int | float:
+        """
+        Remainder of the PLU at the end of the date
+        """
+        self._check_loaded()
+        series = self._series.get(plu)
+        if series is None:
+            return 0
+        end = bisect.bisect_right(series.dates, date)
+        k = bisect.bisect_right(series.inventory_dates, date) - 1
+        if k >= 0:
+            inventory_date = series.inventory_dates[k]
+            base, start = series.inventory[inventory_date], bisect.bisect_right(series.dates, inventory_date)
+        else:
+            base, start = 0, 0
+        return round_weight(base + series.total('net', start, max(start, end)))
+
+    def sales(self, plu: int, start: datetime.date, end: datetime.date, customer: str | None = None) -> int | float:
+        """
+        Sales of the PLU from start to end (inclusive): to the customer if it is given,
+        else to all customers except write-offs
+        """
+        self._check_loaded()
+        series = self._series.get(plu)
+        if series is None:
+            return 0
+        field = 'sale' if customer is None else f'customer:{customer}'
+        i, j = bisect.bisect_left(series.dates, start), bisect.bisect_right(series.dates, end)
+        return round_weight(series.total(field, i, j))
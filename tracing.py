@@ -0,0 +1,76 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+
+class Tracer:
+    """
+    Writes nested spans as Chrome trace events, one JSON object per line.
+    Disabled until open() is called, then span() is a no-op
+    """
+    def __init__(self) -> None:
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    def open(self, path: str | Path) -> None:
+        self.close()
+        self._file = open(path, 'a', encoding='utf8', buffering=1)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @contextmanager
+    def span(self, name: str, cat: str = 'ingest', **args: Any) -> Iterator[None]:
+        """
+        Record the wrapped block as a complete ("X") event.
+        Nesting is derived by the viewer from timestamps of the same thread
+        """
+        if self._file is None:
+            yield
+            return
+        ts = time.time_ns() // 1000
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            event = {
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': ts,
+                'dur': (time.perf_counter_ns() - start) // 1000,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': {k: str(v) for k, v in args.items()},
+            }
+            self._write(event)
+
+    def _write(self, event: dict) -> None:
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + '\n')
+
+
+def to_chrome_trace(jsonl_path: str | Path, json_path: str | Path) -> None:
+    """
+    Convert JSONL trace file to the JSON object format
+    accepted by chrome://tracing and ui.perfetto.dev
+    """
+    with open(jsonl_path, 'r', encoding='utf8') as file:
+        events = [json.loads(line) for line in file if line.strip()]
+    with open(json_path, 'w', encoding='utf8') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file, ensure_ascii=False)
+
+
+tracer = Tracer()
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import datetime
+import dataclasses
+from pathlib import Path
+from typing import Any, Callable
+from spreadsheet import Shipment, Income, Sale, Inventory
+
+
+ITEM_TYPES = {
+    'shipment': Shipment,
+    'income': Income,
+    'sale': Sale,
+    'inventory': Inventory,
+}
+
+
+@dataclasses.dataclass
+class BufferedOperation:
+    operation: str
+    items: list[Shipment | Income | Sale | Inventory]
+    date: datetime.date
+    source: str
+    accepted_at: float
+    content_hash: str | None = None
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'operation': self.operation,
+            'items': [dataclasses.asdict(item) for item in self.items],
+            'date': self.date.isoformat(),
+            'source': self.source,
+            'accepted_at': self.accepted_at,
+            'content_hash': self.content_hash,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, line: str) -> 'BufferedOperation':
+        data = json.loads(line)
+        item_type = ITEM_TYPES[data['operation']]
+        return cls(
+            operation=data['operation'],
+            items=[item_type(**item) for item in data['items']],
+            date=datetime.date.fromisoformat(data['date']),
+            source=data['source'],
+            accepted_at=data['accepted_at'],
+            content_hash=data.get('content_hash'),
+        )
+
+
+class WriteBuffer:
+    """
+    Durable write-behind buffer. Every accepted operation is appended to a JSONL file and fsynced,
+    so its csv file can be acknowledged before the spreadsheet is written.
+    Buffered operations are flushed in one spreadsheet batch when max_ops are collected
+    or the oldest one waits max_age seconds. Operations left by a previous run are loaded back
+    """
+    def __init__(self, path: str | Path, max_ops: int = 100, max_age: float = 300.0, logger=None) -> None:
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._max_ops = max_ops
+        self._max_age = max_age
+        self._logger = logger
+        self._operations: list[BufferedOperation] = []
+        if self._path.exists():
+            broken = False
+            with open(self._path, 'r', encoding='utf8') as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    try:
+                        self._operations.append(BufferedOperation.from_json(line))
+                    except (ValueError, KeyError, TypeError):  # line torn by a crash while it was written
+                        broken = True
+                        if self._logger is not None:
+                            self._logger.warning(f'Skipped broken line of write buffer {self._path}: {line!r}')
+            if broken:
+                self._rewrite()
+
+    def __len__(self) -> int:
+        return len(self._operations)
+
+    def add(self, operation: str, items: list, date: datetime.date, source: str,
+            content_hash: str | None = None) -> None:
+        buffered = BufferedOperation(operation, items, date, source, time.time(), content_hash)
+        with open(self._path, 'a', encoding='utf8') as file:
+            file.write(buffered.to_json() + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self._operations.append(buffered)
+
+    def seconds_left(self) -> float | None:
+        """
+        Seconds until the oldest operation is max_age old, None if the buffer is empty
+        """
+        if not self._operations:
+            return None
+        return max(0.0, self._operations[0].accepted_at + self._max_age - time.time())
+
+    def due(self) -> bool:
+        if not self._operations:
+            return False
+        return len(self._operations) >= self._max_ops or self.seconds_left() == 0
+
+    def drop(self, predicate: Callable[[BufferedOperation], bool]) -> list[BufferedOperation]:
+        """
+        Removes operations matching predicate, returns them
+        """
+        dropped = [buffered for buffered in self._operations if predicate(buffered)]
+        if dropped:
+            self._operations = [buffered for buffered in self._operations if not predicate(buffered)]
+            self._rewrite()
+        return dropped
+
+    def flush(self, g: Any, apply: Callable[[Any, str, list, datetime.date], None],
+              commit: Callable[[list[BufferedOperation]], None] | None = None) -> list[BufferedOperation]:
+        """
+        Applies buffered operations inside g.batch() with apply(g, operation, items, date).
+        Operations are removed from the buffer as soon as their values are written, so a failure
+        of the steps after the write does not apply them again on the next flush.
+        commit is called with the written operations before they are removed from the buffer file.
+        Operations which are rejected while being queued (unknown PLU) are logged and dropped.
+        If the batch fails before the write, the buffer is kept for the next flush.
+        Returns applied operations
+        """
+        if not self._operations:
+            return []
+        pending = list(self._operations)
+        by_items = {id(buffered.items): buffered for buffered in pending}
+        applied: list[BufferedOperation] = []
+        rejected: list[BufferedOperation] = []
+
+        def acknowledge(written: list[list]) -> None:
+            done = [by_items[id(items)] for items in written if id(items) in by_items]
+            if commit is not None:
+                commit(done)
+            done = {id(buffered) for buffered in done}
+            self._operations = [buffered for buffered in self._operations if id(buffered) not in done]
+            self._rewrite()
+
+        with g.batch(on_written=acknowledge):
+            for buffered in pending:
+                try:
+                    apply(g, buffered.operation, buffered.items, buffered.date)
+                    applied.append(buffered)
+                except ValueError as e:
+                    rejected.append(buffered)
+                    if self._logger is not None:
+                        self._logger.error(f'Dropped buffered {buffered.operation} of {buffered.source}: {e}')
+        self.drop(lambda buffered: any(buffered is r for r in rejected))
+        return applied
+
+    def _rewrite(self) -> None:
+        """
+        Replaces the file with buffered operations atomically
+        """
+        tmp_path = self._path.with_name(self._path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf8') as file:
+            for buffered in self._operations:
+                file.write(buffered.to_json() + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self._path)